@@ -1,12 +1,54 @@
+import json
+import mmap
+import os
+import struct
 import sys
-from functools import cache
+from array import array
+from collections import OrderedDict
+from heapq import heapify, heappop, heappush
+from itertools import chain
+from operator import attrgetter, methodcaller
+from time import perf_counter, time
 from typing import Callable, Iterable, List, Tuple, Type
 
 import pygame
 from pygame.locals import *
 
+from capture import FrameRecorder
 from semirandom import randint
 
+# colors of every tile type, index 0 is the empty cell
+PALETTE: List[Tuple[int, int, int]] = [(0, 0, 0)]
+# number of palette entries (color variations) per tile type
+PALETTE_VARIANTS = 8
+# every material compiled from the spec file, a tile type id is its index in this list plus one (0 is the empty cell)
+TILE_TYPES: List[type] = []
+
+# material properties compiled from the spec file, indexed by tile type id (index 0 is the empty cell)
+DENSITY = array("q", [0])
+BASE_HEAT = array("q", [0])
+BASE_HEAT_JITTER = array("q", [0])
+HEAT_TRANSFER_COEFFICIENT = array("d", [0])
+PASSIVE_HEAT_LOSS = array("q", [0])
+# heat thresholds and the type id the tile becomes, 0 removes the tile and -1 means there is no threshold
+UPPER_THRESHOLD_HEAT = array("q", [0])
+UPPER_THRESHOLD_TYPE = array("h", [-1])
+LOWER_THRESHOLD_HEAT = array("q", [0])
+LOWER_THRESHOLD_TYPE = array("h", [-1])
+
+HASH_MASK = (1 << 64) - 1
+# the world hash puts heat values in buckets of 2^HEAT_HASH_SHIFT degrees
+HEAT_HASH_SHIFT = 4
+
+
+def zobrist_key(cell: int, type_id: int, heat_bucket: int) -> int:
+    """ returns the pseudo random 64 bit key of a cell content (splitmix64 finalizer) """
+    key = (cell * 0x9E3779B97F4A7C15 + type_id * 0xBF58476D1CE4E5B9 + heat_bucket * 0x94D049BB133111EB) & HASH_MASK
+    key = ((key ^ (key >> 30)) * 0xBF58476D1CE4E5B9) & HASH_MASK
+    key = ((key ^ (key >> 27)) * 0x94D049BB133111EB) & HASH_MASK
+    return key ^ (key >> 31)
+
+
 #############################
 #---------- World -----------
 #############################
@@ -51,20 +93,24 @@ class NextPosition:
 
 class Tile:
 
+    # set from the material spec when the materials are compiled
     NAME: str
-
-    def __init__(
-            self,
-            color: Tuple[int, int, int],
-            density: int,
-            world: "World",
-            x: int,
-            y: int
-    ):
+    TYPE_ID: int
+    # index of the first palette entry of the tile type
+    PALETTE_BASE: int
+    density: int
+
+    # set when the custom tile, heat or movement system retired the tile from its active set
+    dormant: bool = False
+    heat_dormant: bool = False
+    movement_dormant: bool = False
+    # order in which the tile was added to the world, the active lists are updated in that order
+    sequence: int
+
+    def __init__(self, world: "World", x: int, y: int):
         # render stuff
-        self.color = color
-        # Physics stuff
-        self.density = density
+        self.jitter: int = randint(PALETTE_VARIANTS)
+        self.color_index: int = self.PALETTE_BASE + self.jitter
         # position
         self.x = x
         self.y = y
@@ -75,18 +121,35 @@ class Tile:
 
     def remove(self):
         if self.active:
-            self.world.tiles_to_delete.append(self)
+            self.world.commands.push_remove(self)
             self.active = False
             return True
         return False
 
+    @property
+    def color(self) -> Tuple[int, int, int]:
+        return PALETTE[self.color_index]
+
+    def get_hash_key(self, cell: int) -> int:
+        return zobrist_key(cell, self.TYPE_ID, 0)
+
+    def set_jitter(self, jitter: int):
+        self.jitter = jitter
+        self.color_index = self.PALETTE_BASE + jitter
+
     def add(self):
+        self.sequence = self.world.tile_sequence
+        self.world.tile_sequence += 1
         self.world.tiles.append(self)
-        self.world.spatial_matrix[self.y][self.x] = self
+        self.world.set_cell(self.x, self.y, self)
 
     def delete(self):
         self.world.tiles.remove(self)
-        self.world.spatial_matrix[self.y][self.x] = None
+        self.world.set_cell(self.x, self.y, None)
+
+    def wake(self):
+        # subclasses put the tile back in the active sets it was retired from
+        pass
 
     def get_next_pos(self, relative_vector: Tuple[int, int]) -> NextPosition:
         # returns the world position given a vector relative to the tile
@@ -110,33 +173,48 @@ class Tile:
     def transform(self, new_type: type) -> "Tile" or None:
         if self.remove():
             new_tile = new_type(self.world, self.x, self.y)
-            self.world.tiles_to_add.append(new_tile)
+            # keep the color variation so a transform only changes the palette slice
+            new_tile.set_jitter(self.jitter)
+            self.world.commands.push_add(new_tile)
             return new_tile
         return None
 
 
 class MovingTile(Tile):
 
-    _MAX_UPDATE_SKIP = 3
-
-    def __init__(self, color: Tuple[int, int, int], density: int, world: "World", x: int, y: int):
-        super().__init__(color, density, world, x, y)
-        self._skip_update: int = 0
-        self._cooldown: int = 0
-
     def add(self):
         super().add()
         self.world.moving_tiles.append(self)
+        self.world.active_moving_tiles.append(self)
 
     def delete(self):
         super().delete()
         self.world.moving_tiles.remove(self)
+        if self.movement_dormant:
+            self.movement_dormant = False
+            self.world.dormant_tiles -= 1
+
+    def retire_movement(self):
+        """ takes the tile out of the active moving tiles until one of its neighbouring cells changes """
+        if not self.movement_dormant:
+            self.movement_dormant = True
+            self.world.dormant_tiles += 1
+
+    def wake_movement(self):
+        if self.movement_dormant and self.active:
+            self.movement_dormant = False
+            self.world.dormant_tiles -= 1
+            self.world.active_moving_tiles.append(self)
+
+    def wake(self):
+        super().wake()
+        self.wake_movement()
 
     def move(self, new_x: int, new_y: int, replacement_tile: "Tile" or None):
-        self.world.spatial_matrix[self.y][self.x] = replacement_tile
+        self.world.set_cell(self.x, self.y, replacement_tile)
         self.x = new_x
         self.y = new_y
-        self.world.spatial_matrix[self.y][self.x] = self
+        self.world.set_cell(self.x, self.y, self)
 
     def try_move(self, direction: Tuple[int, int]) -> bool:
         next_pos = self.get_next_pos(direction)
@@ -155,18 +233,12 @@ class MovingTile(Tile):
         return False
 
     def check_directions(self, directions: Iterable[Tuple[int, int]]):
-        if self._cooldown == 0:
-            for direction in directions:
-                if self.try_move(direction):
-                    self._skip_update = 0
-                    self.last_update = self.world.update_count
-                    return
-        else:
-            self._cooldown -= 1
-            return
-        if self._skip_update != self._MAX_UPDATE_SKIP:
-            self._skip_update += 1
-        self._cooldown = self._skip_update
+        for direction in directions:
+            if self.try_move(direction):
+                self.last_update = self.world.update_count
+                return
+        # every cell around is blocked, only a change in one of them can free the tile
+        self.retire_movement()
 
     def update_position(self):
         raise NotImplemented
@@ -177,40 +249,63 @@ class HeatTile(Tile):
     UPPER_HEATH_THRESHOLD: Tuple[int, Type[Tile]] or None = None
     LOWER_HEATH_THRESHOLD: Tuple[int, Type[Tile]] or None = None
 
+    # a tile whose heat did not change at all for THERMAL_SETTLE_TICKS ticks is in equilibrium, a dormant tile is
+    # woken up when its heat changes and when the heat of one of its neighbours does
+    THERMAL_SETTLE_TICKS = 8
+
+    # set from the material spec when the materials are compiled
+    heat_transfer_coefficient: float
+    passive_heath_loss: int
     check_thresholds: Callable
 
-    def __init__(
-            self,
-            color: Tuple[int, int, int],
-            density: int,
-            world: "World",
-            x: int,
-            y: int,
-            base_heat: int = 25,
-            heat_transfer_coefficient: float = 1,
-            passive_heat_loss: int = 0
-    ):
-        super().__init__(color, density, world, x, y)
-        self.heat = base_heat
-        self.heat_transfer_coefficient = heat_transfer_coefficient
-        self.passive_heath_loss = passive_heat_loss
-        # optimize threshold check
-        if self.UPPER_HEATH_THRESHOLD and (not self.LOWER_HEATH_THRESHOLD):
-            self.check_thresholds = self.check_upper_threshold
-        elif (not self.UPPER_HEATH_THRESHOLD) and self.LOWER_HEATH_THRESHOLD:
-            self.check_thresholds = self.check_lower_threshold
-        elif self.UPPER_HEATH_THRESHOLD and self.LOWER_HEATH_THRESHOLD:
-            self.check_thresholds = self.check_both_thresholds
-        else:
-            self.check_thresholds = self.check_no_threshold
+    def __init__(self, world: "World", x: int, y: int):
+        super().__init__(world, x, y)
+        heat_jitter = BASE_HEAT_JITTER[self.TYPE_ID]
+        self.heat = BASE_HEAT[self.TYPE_ID] + (randint(heat_jitter) if heat_jitter else 0)
+        self._stable_ticks: int = 0
+        # set whenever the heat changes, whatever changed it, and cleared by the update of the tile
+        self._heat_changed: bool = True
 
     def add(self):
         super().add()
         self.world.heat_tiles.append(self)
+        self.world.active_heat_tiles.append(self)
 
     def delete(self):
         super().delete()
         self.world.heat_tiles.remove(self)
+        if self.heat_dormant:
+            self.heat_dormant = False
+            self.world.dormant_tiles -= 1
+
+    def retire_heat(self):
+        """ takes the tile out of the active heat tiles until its heat or a neighbouring cell changes """
+        if not self.heat_dormant:
+            self.heat_dormant = True
+            self.world.dormant_tiles += 1
+
+    def wake_heat(self):
+        if self.heat_dormant and self.active:
+            self.heat_dormant = False
+            self.world.dormant_tiles -= 1
+            self._stable_ticks = 0
+            self.world.active_heat_tiles.append(self)
+
+    def wake(self):
+        super().wake()
+        self.wake_heat()
+
+    def get_hash_key(self, cell: int) -> int:
+        return zobrist_key(cell, self.TYPE_ID, self.heat >> HEAT_HASH_SHIFT)
+
+    def change_heat(self, amount: int):
+        """ changes the heat of the tile and keeps the world hash up to date """
+        old_bucket = self.heat >> HEAT_HASH_SHIFT
+        self.heat += amount
+        if (self.heat >> HEAT_HASH_SHIFT) != old_bucket:
+            self.world.rehash_heat(self, old_bucket)
+        self._heat_changed = True
+        self.wake_heat()
 
     def check_no_threshold(self) -> bool:
         return False
@@ -243,20 +338,37 @@ class HeatTile(Tile):
     def exchange_heat(self, target_tile: "HeatTile"):
         htc: float = self.heat_transfer_coefficient + target_tile.heat_transfer_coefficient
         exchanged_heat = int((target_tile.heat - self.heat) * htc) >> 2
-        self.heat += exchanged_heat
-        target_tile.heat -= exchanged_heat
+        if not exchanged_heat:
+            return
+        self.change_heat(exchanged_heat)
+        target_tile.change_heat(-exchanged_heat)
 
-    @cache
     def can_tile_exchange_heat(self, tile):
-        return (tile is not None) and (tile in self.world.heat_tiles)
+        # every heat tile on the spatial matrix is registered in world.heat_tiles
+        return isinstance(tile, HeatTile)
 
     def do_exchange_heat(self):
-        self.heat -= self.passive_heath_loss
+        neighbours: List[HeatTile] = []
+        if self.passive_heath_loss:
+            self.change_heat(-self.passive_heath_loss)
         for direction in Dir.ALL:
             tile: Tile = self.get_neighbour_tile(direction)
             if self.can_tile_exchange_heat(tile):
+                neighbours.append(tile)
                 self.exchange_heat(tile)
-        self.check_thresholds()
+        if self.check_thresholds():
+            return
+        if self._heat_changed:
+            # even a heat that came back to its old value was seen by the neighbours in between, so the
+            # dormant ones would now compute different exchanges with the tile
+            self._heat_changed = False
+            self._stable_ticks = 0
+            for tile in neighbours:
+                tile.wake_heat()
+        else:
+            self._stable_ticks += 1
+            if self._stable_ticks >= self.THERMAL_SETTLE_TICKS:
+                self.retire_heat()
 
     def update_temperature(self):
         raise NotImplemented
@@ -267,10 +379,29 @@ class CustomTile(Tile):
     def add(self):
         super().add()
         self.world.custom_tiles.append(self)
+        self.world.custom_tile_frontier.append(self)
 
     def delete(self):
         super().delete()
         self.world.custom_tiles.remove(self)
+        if self.dormant:
+            self.dormant = False
+            self.world.dormant_tiles -= 1
+
+    def retire(self, wake_at: int or None = None):
+        """ takes the tile out of the custom tile frontier until one of its neighbouring cells changes """
+        if not self.dormant:
+            self.dormant = True
+            self.world.dormant_tiles += 1
+            if wake_at is not None:
+                self.world.custom_tile_system.set_alarm(self, wake_at)
+
+    def wake(self):
+        super().wake()
+        if self.dormant and self.active:
+            self.dormant = False
+            self.world.dormant_tiles -= 1
+            self.world.custom_tile_frontier.append(self)
 
     def custom_update(self):
         raise NotImplemented
@@ -283,6 +414,37 @@ class GenericSystem:
     def __init__(self, world: "World"):
         self.world = world
 
+    def select_tiles(self, tiles: List[Tile]) -> List[Tile]:
+        """ filters the tiles down to the ones inside the region updated this tick """
+        region = self.world.get_update_region()
+        if region is None:
+            return tiles
+        x0, y0, x1, y1 = region
+        return [tile for tile in tiles if x0 <= tile.x < x1 and y0 <= tile.y < y1]
+
+    def update_active_tiles(self, list_name: str, dormant_flag: str, update_tile: Callable[[Tile], None],
+                            select: Callable[[List[Tile]], List[Tile]] = None):
+        """ updates the tiles of one of the active lists of the world, then drops the ones that went dormant """
+        # tiles woken up during the tick are appended to the new list and join the update on the next tick
+        world = self.world
+        active_tiles = getattr(world, list_name)
+        setattr(world, list_name, [])
+        tiles = self.select_tiles(active_tiles)
+        if select is not None:
+            tiles = select(tiles)
+        for tile in tiles:
+            # tiles removed after the list was pruned are skipped
+            if tile.active:
+                update_tile(tile)
+        woken_tiles = getattr(world, list_name)
+        active_tiles = [*dict.fromkeys(
+            tile for tile in chain(active_tiles, woken_tiles) if tile.active and not getattr(tile, dormant_flag)
+        )]
+        # the outcome of a tick depends on the update order, woken tiles are put back where they were added
+        if woken_tiles:
+            active_tiles.sort(key=attrgetter("sequence"))
+        setattr(world, list_name, active_tiles)
+
     def update(self):
         raise NotImplemented
 
@@ -292,9 +454,134 @@ class MovementSystem(GenericSystem):
     NAME = "Movement System"
 
     def update(self):
-        for tile in self.world.moving_tiles:
-            if tile.last_update != self.world.update_count:
-                tile.update_position()
+        # only tiles that can still move are updated
+        self.update_active_tiles("active_moving_tiles", "movement_dormant", self.move_tile)
+
+    def move_tile(self, tile: MovingTile):
+        if tile.last_update != self.world.update_count:
+            tile.update_position()
+
+
+class LiquidBody:
+
+    def __init__(self, surface_y: int):
+        # row of the highest surface tile, no resting cell is more than one row below it
+        self.surface_y = surface_y
+        # cleared once the body has to be flood filled again
+        self.settled: bool = True
+
+
+class LiquidSystem(GenericSystem):
+
+    NAME = "Liquid System"
+
+    # the liquid bodies that are still moving are levelled once every LEVELING_INTERVAL ticks
+    LEVELING_INTERVAL = 4
+    # smaller bodies are left to the movement system
+    MIN_BODY_SIZE = 8
+    SIDES = (Dir.LEFT, Dir.RIGHT, Dir.DOWN, Dir.UP)
+    HOLE_SIDES = (Dir.LEFT, Dir.RIGHT, Dir.DOWN)
+
+    def find_body(self, seed: "LiquidTile", visited: set) -> List["LiquidTile"]:
+        """ returns the tiles of the same liquid connected to the seed """
+        world = self.world
+        body = [seed]
+        visited.add(seed)
+        stack = [seed]
+        while stack:
+            tile = stack.pop()
+            for direction in self.SIDES:
+                next_x = tile.x + direction[0]
+                next_y = tile.y + direction[1]
+                if not (0 <= next_x < world.width and 0 <= next_y < world.height):
+                    continue
+                neighbour = world.spatial_matrix[next_y][next_x]
+                if (type(neighbour) is type(seed)) and (neighbour not in visited):
+                    visited.add(neighbour)
+                    body.append(neighbour)
+                    stack.append(neighbour)
+        return body
+
+    def level_body(self, body: List["LiquidTile"]) -> int or None:
+        """ levels the body, returns the row of its highest surface tile if it is already level, None otherwise """
+        # the highest surface tiles of the body are moved to the lowest free cells along it, like the
+        # pressure of a connected body of liquid would do, the moves are planned on top of the current
+        # cells and applied by the command buffer
+        world = self.world
+        matrix = world.spatial_matrix
+        body_tiles = set(body)
+        filled = set()
+        vacated = set()
+
+        def is_free(x: int, y: int) -> bool:
+            if not (0 <= x < world.width and 0 <= y < world.height) or ((x, y) in filled):
+                return False
+            return (not matrix[y][x]) and ((x, y) not in vacated)
+
+        def push_hole(x: int, y: int):
+            # only cells the liquid would rest in
+            if is_free(x, y) and (y + 1 == world.height or not is_free(x, y + 1)):
+                heappush(holes, (-y, x))
+
+        holes: List[Tuple[int, int]] = []
+        surface: List[Tuple[int, int, "LiquidTile"]] = []
+        for index, tile in enumerate(body):
+            if tile.y > 0 and not matrix[tile.y - 1][tile.x]:
+                surface.append((tile.y, index, tile))
+            for direction in self.HOLE_SIDES:
+                push_hole(tile.x + direction[0], tile.y + direction[1])
+        heapify(surface)
+        index = len(body)
+        moved = False
+        while holes and surface:
+            hole_y, hole_x = -holes[0][0], holes[0][1]
+            if not is_free(hole_x, hole_y):
+                heappop(holes)
+                continue
+            top_y, _, tile = surface[0]
+            if top_y + 1 >= hole_y:
+                break
+            heappop(holes)
+            heappop(surface)
+            world.commands.push_move(tile, hole_x, hole_y)
+            moved = True
+            vacated.add((tile.x, top_y))
+            filled.add((hole_x, hole_y))
+            # the tile under the moved one is now at the surface
+            if top_y + 1 < world.height:
+                below_tile = matrix[top_y + 1][tile.x]
+                if below_tile in body_tiles:
+                    heappush(surface, (top_y + 1, index, below_tile))
+                    index += 1
+            # and the filled hole opens the cells around it
+            push_hole(hole_x - 1, hole_y)
+            push_hole(hole_x + 1, hole_y)
+            push_hole(hole_x, hole_y - 1)
+        if moved or (holes and not surface):
+            return None
+        return surface[0][0] if surface else min(tile.y for tile in body)
+
+    def update(self):
+        if self.world.update_count % self.LEVELING_INTERVAL:
+            return
+        # settled bodies have no active tile and cost nothing
+        visited = set()
+        for tile in self.world.active_moving_tiles:
+            if isinstance(tile, LiquidTile) and tile.active and (tile not in visited):
+                settled_body = tile.liquid_body
+                if settled_body and settled_body.settled:
+                    # a tile moving along the surface of a level body, like a surplus drop wandering
+                    # on it, can neither raise the surface nor open a lower cell
+                    if settled_body.surface_y <= tile.y <= settled_body.surface_y + 1:
+                        continue
+                    settled_body.settled = False
+                body = self.find_body(tile, visited)
+                if len(body) >= self.MIN_BODY_SIZE:
+                    surface_y = self.level_body(body)
+                    if surface_y is not None:
+                        settled_body = LiquidBody(surface_y)
+                        for body_tile in body:
+                            body_tile.liquid_body = settled_body
 
 
 class HeathSystem(GenericSystem):
@@ -302,75 +589,560 @@ class HeathSystem(GenericSystem):
     NAME = "Heath System"
 
     def update(self):
-        for tile in self.world.heat_tiles:
-            tile.update_temperature()
+        # only thermally active tiles are updated
+        self.update_active_tiles("active_heat_tiles", "heat_dormant", methodcaller("update_temperature"),
+                                 self.slice_tiles)
+
+    def slice_tiles(self, tiles: List["HeatTile"]) -> List["HeatTile"]:
+        # under pressure the world is split in bands and only one band in N is updated each tick
+        world = self.world
+        slices = world.scheduler.get_heat_slices()
+        if slices <= 1:
+            return tiles
+        phase = world.update_count % slices
+        band_height = world.scheduler.HEAT_BAND_HEIGHT
+        return [tile for tile in tiles if (tile.y // band_height) % slices == phase]
 
 
 class CustomTileSystem(GenericSystem):
 
     NAME = "Custom Tile System"
 
+    def __init__(self, world: "World"):
+        super().__init__(world)
+        # (tick, sequence, tile) of the dormant tiles that asked to be woken up
+        self.alarms: List[Tuple[int, int, CustomTile]] = []
+        self._alarm_sequence: int = 0
+
+    def set_alarm(self, tile: CustomTile, wake_at: int):
+        heappush(self.alarms, (wake_at, self._alarm_sequence, tile))
+        self._alarm_sequence += 1
+
+    def update(self):
+        world = self.world
+        while self.alarms and self.alarms[0][0] <= world.update_count:
+            heappop(self.alarms)[2].wake()
+        # only the frontier is updated
+        self.update_active_tiles("custom_tile_frontier", "dormant", methodcaller("custom_update"))
+
+
+class AreaEffectSystem(GenericSystem):
+
+    NAME = "Area Effect System"
+
+    BLAST_HEAT = 2000
+    WAVE_TICKS_PER_RING = 1
+    BLAST_DIRECTIONS = (Dir.UP, Dir.LEFT, Dir.RIGHT, Dir.DOWN)
+
+    def __init__(self, world: "World"):
+        super().__init__(world)
+        # blasts requested during this tick (x, y, range)
+        self.blasts: List[Tuple[int, int, int]] = []
+        # visual waves being played: [rings, smoke cells, age]
+        self.waves: List[list] = []
+
+    def add_blast(self, x: int, y: int, blast_range: int):
+        """ schedules a blast, it is resolved at the end of the current tick """
+        self.blasts.append((x, y, blast_range))
+
+    def get_wave_cells(self) -> Iterable[Tuple[int, int]]:
+        """ returns the cells of the wave fronts that should be drawn this frame """
+        for rings, _, age in self.waves:
+            ring = age // self.WAVE_TICKS_PER_RING
+            if ring < len(rings):
+                yield from rings[ring]
+
+    def resolve_blasts(self) -> Tuple[List[List[Tuple[int, int]]], List[Tuple[int, int]], List[Tile]]:
+        # flood the air around every blast of this tick in a single pass,
+        # a cell is only expanded again if it is reached with a bigger remaining range
+        world = self.world
+        max_range = max(blast[2] for blast in self.blasts)
+        buckets: List[List[Tuple[int, int]]] = [[] for _ in range(max_range + 1)]
+        best_range = {}
+        for x, y, blast_range in self.blasts:
+            if best_range.get((x, y), -1) < blast_range:
+                best_range[(x, y)] = blast_range
+                buckets[blast_range].append((x, y))
+        rings: List[List[Tuple[int, int]]] = [[] for _ in range(max_range + 1)]
+        hit_tiles = {}
+        for remaining in range(max_range, -1, -1):
+            for x, y in buckets[remaining]:
+                if best_range[(x, y)] != remaining:
+                    continue
+                rings[max_range - remaining].append((x, y))
+                if remaining == 0:
+                    continue
+                for direction in self.BLAST_DIRECTIONS:
+                    next_x = x + direction[0]
+                    next_y = y + direction[1]
+                    if not (0 <= next_x < world.width and 0 <= next_y < world.height):
+                        continue
+                    checked_tile = world.spatial_matrix[next_y][next_x]
+                    if checked_tile:
+                        # the wave stops at the first layer of tiles it hits
+                        if type(checked_tile) != ExplosionTile:
+                            hit_tiles[checked_tile] = None
+                        continue
+                    if best_range.get((next_x, next_y), -1) < remaining - 1:
+                        best_range[(next_x, next_y)] = remaining - 1
+                        buckets[remaining - 1].append((next_x, next_y))
+        smoke_cells = [cell for cell, remaining in best_range.items() if remaining == 0]
+        return rings, smoke_cells, list(hit_tiles)
+
     def update(self):
-        for tile in self.world.custom_tiles:
-            tile.custom_update()
+        # play the waves and spawn the smoke once a wave is over
+        if self.waves:
+            for wave in self.waves:
+                wave[2] += 1
+            for rings, smoke_cells, age in self.waves:
+                if age // self.WAVE_TICKS_PER_RING >= len(rings):
+                    # overlapping waves are sorted out by the command buffer, one smoke tile per cell
+                    for x, y in smoke_cells:
+                        if not self.world.spatial_matrix[y][x]:
+                            self.world.commands.push_add(SmokeTile(self.world, x, y))
+            self.waves = [wave for wave in self.waves if wave[2] // self.WAVE_TICKS_PER_RING < len(wave[0])]
+        if not self.blasts:
+            return
+        rings, smoke_cells, hit_tiles = self.resolve_blasts()
+        self.blasts.clear()
+        # apply heat and removals in bulk, tiles that change state because of the heat survive
+        for tile in hit_tiles:
+            if isinstance(tile, HeatTile):
+                tile.change_heat(self.BLAST_HEAT)
+                if tile.check_thresholds():
+                    continue
+            tile.remove()
+        self.waves.append([rings, smoke_cells, 0])
+
+
+class CommandBuffer:
+
+    # kinds of commands, also the order they are applied in
+    REMOVE = 0
+    MOVE = 1
+    ADD = 2
+
+    def __init__(self, world: "World"):
+        self.world = world
+        # (kind, cell, sequence, tile, target x, target y)
+        self.commands: List[Tuple[int, int, int, Tile, int, int]] = []
+
+    def push(self, kind: int, tile: Tile, x: int, y: int):
+        self.commands.append((kind, y * self.world.width + x, len(self.commands), tile, x, y))
+
+    def push_remove(self, tile: Tile):
+        self.push(self.REMOVE, tile, tile.x, tile.y)
+
+    def push_move(self, tile: Tile, x: int, y: int):
+        """ moves the tile to an empty cell """
+        self.push(self.MOVE, tile, x, y)
+
+    def push_add(self, tile: Tile):
+        self.push(self.ADD, tile, tile.x, tile.y)
+
+    def apply(self):
+        """ applies every command in a single pass, bucketed by kind and sorted by cell """
+        if not self.commands:
+            return
+        world = self.world
+        # removals free their cells first, then a cell goes to the first move or addition that targets it
+        self.commands.sort(key=lambda command: command[:3])
+        for kind, _, _, tile, x, y in self.commands:
+            if kind == self.REMOVE:
+                tile.delete()
+            elif kind == self.MOVE:
+                if tile.active and not world.spatial_matrix[y][x]:
+                    world.set_cell(tile.x, tile.y, None)
+                    tile.x = x
+                    tile.y = y
+                    world.set_cell(x, y, tile)
+            elif not world.spatial_matrix[y][x]:
+                tile.add()
+        self.commands.clear()
+
+
+class TickScheduler:
+
+    # degradation levels go from 0 (full fidelity) to MAX_LEVEL
+    MAX_LEVEL = 3
+    # ticks in a row under half of the budget needed to go back up one level
+    RECOVERY_TICKS = 30
+    # height (in cells) of the bands the heat system is split into under pressure
+    HEAT_BAND_HEIGHT = 16
+
+    def __init__(self, budget: float or None = None):
+        # time (in seconds) a tick is allowed to take, None always runs at full fidelity
+        self.budget = budget
+        self.level: int = 0
+        self.last_tick_time: float = 0
+        self._fast_ticks: int = 0
+
+    def get_heat_slices(self) -> int:
+        """ returns in how many ticks the heat system goes over the whole world """
+        return 1 << self.level
+
+    def get_outside_region_interval(self, interval: int) -> int:
+        """ returns how often the tiles outside of the region of interest are updated """
+        return interval << self.level
+
+    def record_tick(self, tick_time: float):
+        self.last_tick_time = tick_time
+        if self.budget is None:
+            return
+        if tick_time > self.budget:
+            self._fast_ticks = 0
+            if self.level < self.MAX_LEVEL:
+                self.level += 1
+        elif tick_time < self.budget / 2:
+            self._fast_ticks += 1
+            if self._fast_ticks >= self.RECOVERY_TICKS and self.level > 0:
+                self._fast_ticks = 0
+                self.level -= 1
+        else:
+            self._fast_ticks = 0
+
+
+class PagedOutTile(Tile):
+
+    # fills the cells of the chunks that are paged out, nothing can move into, heat or remove it
+
+    NAME = "Paged out"
+    PALETTE_BASE = 0
+    TYPE_ID = 0
+    density = sys.maxsize
+
+    def __init__(self, world: "World", pager: "ChunkPager"):
+        super().__init__(world, -1, -1)
+        self.pager = pager
+        self.active = False
+
+    def get_hash_key(self, cell: int) -> int:
+        # the world hash keeps the key of the tile stored in the chunk file
+        return self.pager.get_record_hash_key(cell)
+
+
+class ChunkPager:
+
+    # only the tile objects of the cold chunks are paged out, their cells point to a shared placeholder in the
+    # spatial matrix and keep their colour in the colour matrix, so the memory used still grows with the world size
+    # chunks are squares of CHUNK_SIZE * CHUNK_SIZE cells
+    CHUNK_SIZE = 32
+    # record of a cell in the chunk file: type id, jitter, heat (type id 0 is the empty cell)
+    RECORD = struct.Struct("<HBxi")
+    # ticks between two passes that page chunks in and out
+    PAGING_INTERVAL = 30
+
+    def __init__(self, world: "World", path: str, max_resident_chunks: int):
+        self.world = world
+        self.chunks_x = -(-world.width // self.CHUNK_SIZE)
+        self.chunks_y = -(-world.height // self.CHUNK_SIZE)
+        self.chunk_bytes = self.CHUNK_SIZE * self.CHUNK_SIZE * self.RECORD.size
+        # chunks near activity or the camera stay resident, the others are paged out beyond this count
+        self.max_resident_chunks = max_resident_chunks
+        # the file is sparse, chunks that were never paged out cost no disk space
+        self.file = open(path, "w+b")
+        self.file.truncate(self.chunks_x * self.chunks_y * self.chunk_bytes)
+        self.memory = mmap.mmap(self.file.fileno(), 0)
+        # resident chunks from the least to the most recently used, the world starts fully resident
+        self.resident: OrderedDict = OrderedDict.fromkeys(range(self.chunks_x * self.chunks_y))
+        self.paged_out_tile = PagedOutTile(world, self)
+        # region (x0, y0, x1, y1) that is kept resident on top of the active chunks, usually the camera view
+        self.focus_region: Tuple[int, int, int, int] or None = None
+
+    def close(self):
+        self.memory.close()
+        self.file.close()
+
+    def get_chunk(self, x: int, y: int) -> int:
+        return (y // self.CHUNK_SIZE) * self.chunks_x + x // self.CHUNK_SIZE
+
+    def get_chunk_rect(self, chunk: int) -> Tuple[int, int, int, int]:
+        x0 = (chunk % self.chunks_x) * self.CHUNK_SIZE
+        y0 = (chunk // self.chunks_x) * self.CHUNK_SIZE
+        return x0, y0, min(x0 + self.CHUNK_SIZE, self.world.width), min(y0 + self.CHUNK_SIZE, self.world.height)
+
+    def get_record_offset(self, x: int, y: int) -> int:
+        return (
+            self.get_chunk(x, y) * self.chunk_bytes
+            + ((y % self.CHUNK_SIZE) * self.CHUNK_SIZE + x % self.CHUNK_SIZE) * self.RECORD.size
+        )
+
+    def get_record_hash_key(self, cell: int) -> int:
+        y, x = divmod(cell, self.world.width)
+        type_id, _, heat = self.RECORD.unpack_from(self.memory, self.get_record_offset(x, y))
+        if not type_id:
+            return 0
+        return zobrist_key(cell, type_id, heat >> HEAT_HASH_SHIFT)
+
+    def touch(self, x: int, y: int):
+        """ pages in the chunk of the given cell if needed and marks it as recently used """
+        if not (0 <= x < self.world.width and 0 <= y < self.world.height):
+            return
+        chunk = self.get_chunk(x, y)
+        if chunk in self.resident:
+            self.resident.move_to_end(chunk)
+        else:
+            self.page_in(chunk)
+
+    def page_out(self, chunk: int, paged_out_tiles: List[Tile]):
+        """ writes the tiles of the chunk to the file and takes them off the spatial matrix """
+        # the tiles are collected in paged_out_tiles, the caller takes them out of the tile lists
+        world = self.world
+        x0, y0, x1, y1 = self.get_chunk_rect(chunk)
+        for y in range(y0, y1):
+            row = world.spatial_matrix[y]
+            for x in range(x0, x1):
+                tile = row[x]
+                offset = self.get_record_offset(x, y)
+                if tile:
+                    self.RECORD.pack_into(self.memory, offset, tile.TYPE_ID, tile.jitter, getattr(tile, "heat", 0))
+                    paged_out_tiles.append(tile)
+                else:
+                    self.RECORD.pack_into(self.memory, offset, 0, 0, 0)
+                world.set_cell(x, y, self.paged_out_tile)
+                # paged out cells keep their color so the chunk still renders
+                world.color_matrix[y * world.width + x] = tile.color_index if tile else 0
+        del self.resident[chunk]
+
+    def page_in(self, chunk: int):
+        """ recreates the tiles of the chunk from the file """
+        world = self.world
+        x0, y0, x1, y1 = self.get_chunk_rect(chunk)
+        for y in range(y0, y1):
+            for x in range(x0, x1):
+                type_id, jitter, heat = self.RECORD.unpack_from(self.memory, self.get_record_offset(x, y))
+                if not type_id:
+                    world.set_cell(x, y, None)
+                    continue
+                tile = TILE_TYPES[type_id - 1](world, x, y)
+                tile.set_jitter(jitter)
+                if isinstance(tile, HeatTile):
+                    tile.heat = heat
+                # the paged out tile still holds the cell, which keeps the world hash unchanged
+                tile.add()
+        self.resident[chunk] = None
+
+    def get_hot_chunks(self) -> set:
+        """ returns the chunks around the region of interest and the active tiles """
+        world = self.world
+        hot_chunks = set()
+        for region in (self.focus_region, world.simulation_region):
+            if region is None:
+                continue
+            x0, y0, x1, y1 = region
+            for chunk_y in range(y0 // self.CHUNK_SIZE, -(-y1 // self.CHUNK_SIZE)):
+                for chunk_x in range(x0 // self.CHUNK_SIZE, -(-x1 // self.CHUNK_SIZE)):
+                    hot_chunks.add(chunk_y * self.chunks_x + chunk_x)
+        active_tiles = chain(
+            (tile for tile in world.active_moving_tiles if not tile.movement_dormant),
+            (tile for tile in world.active_heat_tiles if not tile.heat_dormant),
+            (tile for tile in world.custom_tile_frontier if not tile.dormant)
+        )
+        for tile in active_tiles:
+            if tile.active:
+                hot_chunks.add(self.get_chunk(tile.x, tile.y))
+        # activity can spill over into the neighbouring chunks
+        for chunk in list(hot_chunks):
+            chunk_x = chunk % self.chunks_x
+            chunk_y = chunk // self.chunks_x
+            for neighbour_y in range(max(chunk_y - 1, 0), min(chunk_y + 2, self.chunks_y)):
+                for neighbour_x in range(max(chunk_x - 1, 0), min(chunk_x + 2, self.chunks_x)):
+                    hot_chunks.add(neighbour_y * self.chunks_x + neighbour_x)
+        return hot_chunks
+
+    def update(self):
+        if self.world.update_count % self.PAGING_INTERVAL:
+            return
+        hot_chunks = self.get_hot_chunks()
+        for chunk in sorted(hot_chunks):
+            if chunk in self.resident:
+                self.resident.move_to_end(chunk)
+            else:
+                self.page_in(chunk)
+        # page out the least recently used cold chunks, hot chunks stay resident even over the limit
+        paged_out_tiles: List[Tile] = []
+        while len(self.resident) > self.max_resident_chunks:
+            chunk = next(iter(self.resident))
+            if chunk in hot_chunks:
+                break
+            self.page_out(chunk, paged_out_tiles)
+        # every tile list is rebuilt once for the whole pass
+        if paged_out_tiles:
+            self.world.detach_tiles(paged_out_tiles)
 
 
 class World:
 
-    def __init__(self, width: int, height: int):
+    def __init__(
+            self,
+            width: int,
+            height: int,
+            tick_budget: float or None = None,
+            chunk_file: str or None = None,
+            max_resident_chunks: int = 256,
+            record_hashes: bool = False
+    ):
         self.width = width
         self.height = height
         # init tile lists
         self.tiles: List[Tile] = []
         self.moving_tiles: List[MovingTile] = []
+        self.active_moving_tiles: List[MovingTile] = []
         self.heat_tiles: List[HeatTile] = []
+        self.active_heat_tiles: List[HeatTile] = []
         self.custom_tiles: List[CustomTile] = []
-        self.tiles_to_delete: List[Tile] = []
-        self.tiles_to_add: List[Tile] = []
+        self.custom_tile_frontier: List[CustomTile] = []
+        self.dormant_tiles: int = 0
+        # sequence number given to the next tile added to the world
+        self.tile_sequence: int = 0
+        # structural changes made during a tick, applied at its end
+        self.commands = CommandBuffer(self)
         # init world matrices
         init_matrix: List[List[Tile or None]] = []
         for _ in range(height):
             init_matrix.append([None for _ in range(width)])
         self.spatial_matrix: Tuple[List[Tile], ...] = tuple(init_matrix)
+        # palette index of every cell, row by row
+        self.color_matrix = bytearray(width * height)
+        # cells changed since the renderer last took them, None until a renderer tracks them
+        self.dirty_cells: set or None = None
+        # xor of the zobrist keys of every cell content, kept up to date on every change
+        self.world_hash: int = 0
+        # world hash at the end of every tick, indexed by the update_count the tick ran with
+        # only recorded on request, it grows by one entry every tick
+        self.hash_history: List[int] or None = [] if record_hashes else None
         # init systems
+        self.custom_tile_system = CustomTileSystem(self)
+        self.area_effect_system = AreaEffectSystem(self)
         self.systems: Iterable[GenericSystem] = (
             MovementSystem(self),
+            LiquidSystem(self),
             HeathSystem(self),
-            CustomTileSystem(self)
+            self.custom_tile_system,
+            self.area_effect_system
         )
         self.update_count: int = 0
+        # region of interest (x0, y0, x1, y1) that is always simulated, None simulates the whole world
+        self.simulation_region: Tuple[int, int, int, int] or None = None
+        # tiles outside of the region of interest are updated once every N ticks, 0 freezes them
+        self.outside_region_interval: int = 8
+        # lowers the simulation fidelity when the ticks take longer than tick_budget seconds
+        self.scheduler = TickScheduler(tick_budget)
+        # keeps the tiles of the cold chunks in a memory mapped file instead of in memory, None keeps all tiles resident
+        self.pager: ChunkPager or None = None
+        if chunk_file is not None:
+            self.pager = ChunkPager(self, chunk_file, max_resident_chunks)
+
+    def get_update_region(self) -> Tuple[int, int, int, int] or None:
+        """ returns the region the systems are limited to during this tick, None for the whole world """
+        if self.simulation_region is None:
+            return None
+        interval = self.scheduler.get_outside_region_interval(self.outside_region_interval)
+        if interval and (self.update_count % interval == 0):
+            return None
+        return self.simulation_region
 
     def add_tile(self, tile_type: type, x: int, y: int) -> Tile:
-        """ adds a tile at the given position and returns it """
+        """ adds a tile at the given position and returns it, only meant to be used between ticks """
+        if self.pager:
+            self.pager.touch(x, y)
         new_tile: Tile = tile_type(self, x, y)
         if not self.spatial_matrix[y][x]:
             new_tile.add()
         return new_tile
 
+    def set_cell(self, x: int, y: int, tile: Tile or None):
+        """ puts the tile (or nothing) in the given cell and wakes up its neighbours """
+        cell = y * self.width + x
+        old_tile = self.spatial_matrix[y][x]
+        if old_tile:
+            self.world_hash ^= old_tile.get_hash_key(cell)
+        if tile:
+            self.world_hash ^= tile.get_hash_key(cell)
+        self.spatial_matrix[y][x] = tile
+        self.color_matrix[cell] = tile.color_index if tile else 0
+        if self.dirty_cells is not None:
+            self.dirty_cells.add(cell)
+        self.wake_neighbours(x, y)
+
+    def rehash_heat(self, tile: "HeatTile", old_bucket: int):
+        """ updates the world hash after the heat of a tile moved to another bucket """
+        if self.spatial_matrix[tile.y][tile.x] is not tile:
+            # the tile is not in the world (yet)
+            return
+        cell = tile.y * self.width + tile.x
+        self.world_hash ^= zobrist_key(cell, tile.TYPE_ID, old_bucket) ^ tile.get_hash_key(cell)
+
+    def compute_hash(self) -> int:
+        """ computes the world hash from scratch, it always matches world_hash """
+        world_hash = 0
+        for y, row in enumerate(self.spatial_matrix):
+            for x, tile in enumerate(row):
+                if tile:
+                    world_hash ^= tile.get_hash_key(y * self.width + x)
+        return world_hash
+
+    def detach_tiles(self, tiles: List[Tile]):
+        """ takes tiles that are no longer on the spatial matrix out of every tile list at once """
+        for tile in tiles:
+            tile.active = False
+            self.dormant_tiles -= tile.dormant + tile.heat_dormant + tile.movement_dormant
+            tile.dormant = tile.heat_dormant = tile.movement_dormant = False
+        self.tiles = [tile for tile in self.tiles if tile.active]
+        self.moving_tiles = [tile for tile in self.moving_tiles if tile.active]
+        self.active_moving_tiles = [tile for tile in self.active_moving_tiles if tile.active]
+        self.heat_tiles = [tile for tile in self.heat_tiles if tile.active]
+        self.active_heat_tiles = [tile for tile in self.active_heat_tiles if tile.active]
+        self.custom_tiles = [tile for tile in self.custom_tiles if tile.active]
+        self.custom_tile_frontier = [tile for tile in self.custom_tile_frontier if tile.active]
+
+    def wake_neighbours(self, x: int, y: int):
+        """ wakes up the dormant tiles around the given position (position included) """
+        if not self.dormant_tiles:
+            return
+        for neighbour_y in range(max(y - 1, 0), min(y + 2, self.height)):
+            row = self.spatial_matrix[neighbour_y]
+            for neighbour_x in range(max(x - 1, 0), min(x + 2, self.width)):
+                tile = row[neighbour_x]
+                if tile and (tile.dormant or tile.heat_dormant or tile.movement_dormant):
+                    tile.wake()
+
     def delete_tile(self, x: int, y: int) -> Tile:
         """ Removes a tile at the given position and returns it """
+        if self.pager:
+            self.pager.touch(x, y)
         tile = self.spatial_matrix[y][x]
         if tile:
             tile.remove()
         return tile
 
     def update(self):
+        start_time = perf_counter()
         # update systems
         for system in self.systems:
             system.update()
-        # delete tiles that need to be deleted
-        if self.tiles_to_delete:
-            for tile in self.tiles_to_delete:
-                tile.delete()
-                del tile
-            self.tiles_to_delete.clear()
-        # add tiles that need to be added
-        if self.tiles_to_add:
-            for tile in self.tiles_to_add:
-                tile.add()
-                del tile
-            self.tiles_to_add.clear()
+        # apply the removals, moves and additions of the tick
+        self.commands.apply()
+        if self.pager:
+            self.pager.update()
+        if self.hash_history is not None:
+            self.hash_history.append(self.world_hash)
         self.update_count += 1
+        self.scheduler.record_tick(perf_counter() - start_time)
+
+
+def find_divergence(hash_history_a: List[int], hash_history_b: List[int]) -> int or None:
+    """ bisects two hash histories and returns the first tick where the runs differ, None if they never do """
+    # once two runs diverged they are assumed to stay different
+    low = 0
+    length = high = min(len(hash_history_a), len(hash_history_b))
+    while low < high:
+        middle = (low + high) // 2
+        if hash_history_a[middle] == hash_history_b[middle]:
+            low = middle + 1
+        else:
+            high = middle
+    return low if low < length else None
 
 
 # Tile types --------------------------------------
@@ -399,6 +1171,9 @@ class LiquidTile(HeatTile, MovingTile):
         (Dir.DOWN, Dir.DOWN_RIGHT, Dir.RIGHT, Dir.DOWN_LEFT, Dir.LEFT)
     )
 
+    # level body the tile was last found in by the liquid system
+    liquid_body: LiquidBody or None = None
+
     def update_position(self):
         self.check_directions(self.DIRECTIONS[randint(2)])
 
@@ -423,278 +1198,24 @@ class GasTile(HeatTile, MovingTile):
 #---------- Tiles -----------
 #############################
 
-TILES: List[Type[Tile]] = []
-
-def add_to_tile_list(tile: Type[Tile]) -> Type[Tile]:
-    TILES.append(tile)
-    return tile
-
-# Solid tiles
-
-@add_to_tile_list
-class ConcreteTile(SolidTile):
-
-    NAME = "Concrete"
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (140 + randint(40), 140 + randint(40), 140 + randint(40)),
-            100000,
-            world,
-            x,
-            y
-        )
+# the materials are defined in this file and compiled into tile types and property tables at startup
+MATERIALS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "materials.json")
 
-@add_to_tile_list
-class WoodTile(SolidTile):
-
-    NAME = "Wood"
-    UPPER_HEATH_THRESHOLD = 500, "BurningWood"
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (117 + randint(40), 63 + randint(40), 4 + randint(40)),
-            10000,
-            world,
-            x,
-            y,
-            heat_transfer_coefficient=0.01
-        )
-
-class BurningWood(SolidTile):
-
-    NAME = "Burning Wood"
-    UPPER_HEATH_THRESHOLD = 2000, "AshTile"
-    LOWER_HEATH_THRESHOLD = 90, WoodTile
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (209 + randint(40), 118 + randint(40), 4),
-            100000,
-            world,
-            x,
-            y,
-            base_heat=500,
-            heat_transfer_coefficient=1,
-            passive_heat_loss=-5
-        )
-
-
-@add_to_tile_list
-class GlassTile(SolidTile):
-
-    NAME = "Glass"
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (152 + randint(40), 203 + randint(40), 206 + randint(40)),
-            100000,
-            world,
-            x,
-            y,
-            heat_transfer_coefficient=0.5
-        )
-
-# Semi solid tiles
-
-@add_to_tile_list
-class SandTile(SemiSolidTile):
-
-    NAME = "Sand"
-    UPPER_HEATH_THRESHOLD = 800, GlassTile
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (205-randint(50), 205-randint(50), 0),
-            10,
-            world,
-            x,
-            y,
-            heat_transfer_coefficient=0.05
-        )
-
-
-@add_to_tile_list
-class RockTile(SemiSolidTile):
-
-    NAME = "Rock"
-    UPPER_HEATH_THRESHOLD = 1000, "LavaTile"
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (40-randint(10), 40-randint(10), 50-randint(10)),
-            800,
-            world,
-            x,
-            y
-        )
-
-
-@add_to_tile_list
-class IceTile(SemiSolidTile):
-
-    NAME = "Ice"
-    UPPER_HEATH_THRESHOLD = 10, "WaterTile"
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (200-randint(20), 200-randint(20), 255-randint(20)),
-            1,
-            world,
-            x,
-            y,
-            base_heat=-40,
-        )
-
-
-@add_to_tile_list
-class AshTile(SemiSolidTile):
-
-    NAME = "Ash"
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (140-randint(20), 140-randint(20), 140-randint(20)),
-            1,
-            world,
-            x,
-            y,
-            base_heat=100,
-        )
-
-
-@add_to_tile_list
-class GunpowderTile(SemiSolidTile):
-
-    NAME = "Gun powder"
-    UPPER_HEATH_THRESHOLD = 500, "ExplosionTile"
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (40-randint(20), 40-randint(20), 40-randint(20)),
-            4,
-            world,
-            x,
-            y
-        )
-
-
-# Liquid tiles
-
-@add_to_tile_list
-class WaterTile(LiquidTile):
-
-    NAME = "Water"
-    UPPER_HEATH_THRESHOLD = 100, "VaporTile"
-    LOWER_HEATH_THRESHOLD = 0, IceTile
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (0, 0, 155+randint(100)),
-            2,
-            world,
-            x,
-            y,
-        )
-
-
-@add_to_tile_list
-class OilTile(LiquidTile):
-
-    NAME = "Oil"
-    UPPER_HEATH_THRESHOLD = 300, "FireTile"
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (193-randint(20), 193-randint(20), 69-randint(10)),
-            1,
-            world,
-            x,
-            y,
-            base_heat=25,
-        )
-
-
-@add_to_tile_list
-class LavaTile(LiquidTile):
-
-    NAME = "Lava"
-    LOWER_HEATH_THRESHOLD = 500, RockTile
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (255 - randint(20), 0, 0),
-            1000,
-            world,
-            x,
-            y,
-            base_heat=10000,
-            heat_transfer_coefficient=0.1
-        )
-
-
-@add_to_tile_list
-class LiquidNitrogen(LiquidTile):
-
-    NAME = "Liquid Nitrogen"
-    UPPER_HEATH_THRESHOLD = 0, None
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (255, 255, 255),
-            0,
-            world,
-            x,
-            y,
-            base_heat=-10000,
-        )
-
-
-# Gas tiles
-
-@add_to_tile_list
-class VaporTile(GasTile):
-
-    NAME = "Vapor"
-    LOWER_HEATH_THRESHOLD = 60, WaterTile
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (255-randint(20), 255-randint(20), 255-randint(20)),
-            0,
-            world,
-            x,
-            y,
-            base_heat=220 + randint(120),
-            passive_heat_loss=1
-        )
-
-
-@add_to_tile_list
-class SmokeTile(GasTile):
-
-    NAME = "Smoke"
-    LOWER_HEATH_THRESHOLD = 100, None
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (50-randint(20), 50-randint(20), 50-randint(20)),
-            0,
-            world,
-            x,
-            y,
-            base_heat=300 + randint(120),
-            passive_heat_loss=1
-        )
+# base class of the materials of every kind, materials without a kind are custom tiles written below
+MATERIAL_KINDS = {
+    "solid": SolidTile,
+    "semi solid": SemiSolidTile,
+    "liquid": LiquidTile,
+    "gas": GasTile
+}
 
+# tile types the player can select
+TILES: List[Type[Tile]] = []
 
-# Custom tiles
+# Custom tiles, their behaviour is written by hand and their properties come from the material spec
 
-@add_to_tile_list
 class FireTile(CustomTile):
 
-    NAME = "Fire"
-
     DIRECTIONS = (
         (Dir.UP, Dir.UP_LEFT, Dir.UP_RIGHT),
         (Dir.UP_LEFT, Dir.UP, Dir.UP_RIGHT),
@@ -705,116 +1226,85 @@ class FireTile(CustomTile):
         (Dir.UP_RIGHT, Dir.UP_LEFT, Dir.RIGHT, Dir.LEFT)
     )
 
+    ALL_DIRECTIONS = (Dir.UP, Dir.UP_LEFT, Dir.UP_RIGHT, Dir.LEFT, Dir.RIGHT)
+
     def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (242-randint(20), 141-randint(20), 0),
-            -2,
-            world,
-            x,
-            y
-        )
-        self.duration: int = 180 + randint(180)
+        super().__init__(world, x, y)
+        # the fire burns out on this tick, heating a tile brings it closer
+        self.burnout_tick: int = world.update_count + 180 + randint(180)
+
+    def is_stuck(self) -> bool:
+        for direction in self.ALL_DIRECTIONS:
+            next_pos = self.get_next_pos(direction)
+            if not next_pos.valid:
+                continue
+            checked_tile: Tile = self.world.spatial_matrix[next_pos.y][next_pos.x]
+            if (not checked_tile) or isinstance(checked_tile, HeatTile):
+                return False
+        return True
 
     def custom_update(self):
+        acted = False
         for direction in self.DIRECTIONS[randint(7)]:
             next_pos = self.get_next_pos(direction)
             if not next_pos.valid:
                 continue
             checked_tile: Tile = self.world.spatial_matrix[next_pos.y][next_pos.x]
             if not checked_tile:
-                self.world.spatial_matrix[self.y][self.x] = None
-                self.x = next_pos.x
-                self.y = next_pos.y
-                self.world.spatial_matrix[self.y][self.x] = self
+                self.world.commands.push_move(self, next_pos.x, next_pos.y)
+                acted = True
                 break
-            elif checked_tile in self.world.heat_tiles:
-                checked_tile.heat += 100
-                self.duration -= 50
+            elif isinstance(checked_tile, HeatTile):
+                checked_tile.change_heat(100)
+                self.burnout_tick -= 50
+                acted = True
                 break
-        self.duration -= 1
-        if self.duration <= 0:
+        if self.world.update_count >= self.burnout_tick:
             self.remove()
+        elif (not acted) and self.is_stuck():
+            # nothing to burn and nowhere to go, sleep until something changes or it burns out
+            self.retire(wake_at=self.burnout_tick)
 
 
-@add_to_tile_list
 class GreyGooTile(CustomTile):
 
-    NAME = "Grey Goo"
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (180, 180, 180),
-            0,
-            world,
-            x,
-            y
-        )
-
     def custom_update(self):
+        idle = True
         for direction in Dir.ALL:
             tile: Tile = self.get_neighbour_tile(direction)
-            if tile and (type(tile) != GreyGooTile):
+            if tile and tile.active and (type(tile) != GreyGooTile):
                 tile.transform(GreyGooTile)
+                idle = False
+        if idle:
+            # surrounded by goo or air, nothing to do until a neighbour changes
+            self.retire()
 
 
-@add_to_tile_list
 class AcidTile(LiquidTile, CustomTile):
 
-    NAME = "Acid"
-
-    def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (0, 235 + randint(20), 0),
-            0,
-            world,
-            x,
-            y
-        )
-
     def custom_update(self):
         if randint(20) != 0:
             return
         for direction in Dir.ALL:
             tile: Tile = self.get_neighbour_tile(direction)
-            if tile and (type(tile) != AcidTile):
+            if tile and tile.active and (type(tile) != AcidTile):
                 tile.remove()
                 self.remove()
                 return
+        self.retire()
 
 
-@add_to_tile_list
 class ExplosionTile(HeatTile, CustomTile):
 
-    NAME = "Explosion"
-
     def __init__(self, world: World, x: int, y: int):
-        super().__init__(
-            (255, 255, 0),
-            10000,
-            world,
-            x,
-            y,
-            base_heat=2000
-        )
+        super().__init__(world, x, y)
         self.range: int = 10
         self.tile_duration: int = 2
 
     def custom_update(self):
         if self.tile_duration == 0:
-            if self.range != 0:
-                new_range = self.range - 1
-                for direction in (Dir.UP, Dir.LEFT, Dir.RIGHT, Dir.DOWN):
-                    next_pos = self.get_next_pos(direction)
-                    if not next_pos.valid:
-                        continue
-                    checked_tile: Tile = self.world.spatial_matrix[next_pos.y][next_pos.x]
-                    if checked_tile and (type(checked_tile) != ExplosionTile):
-                        checked_tile.remove()
-                    new_tile = self.world.add_tile(ExplosionTile, next_pos.x, next_pos.y)
-                    new_tile.range = new_range
-            else:
-                new_tile = SmokeTile(self.world, self.x, self.y)
-                self.world.tiles_to_add.append(new_tile)
+            # the whole blast is resolved by the area effect system
+            self.world.area_effect_system.add_blast(self.x, self.y, self.range)
             self.remove()
         else:
             self.tile_duration -= 1
@@ -823,88 +1313,338 @@ class ExplosionTile(HeatTile, CustomTile):
         self.do_exchange_heat()
 
 
-# This is needed as a workaround of Python's lack of forward declaration
-for tile_to_fix in TILES:
-    if "UPPER_HEATH_THRESHOLD" in tile_to_fix.__dict__:
-        if tile_to_fix.UPPER_HEATH_THRESHOLD:
-            if type(tile_to_fix.UPPER_HEATH_THRESHOLD[1]) == str:
-                tile_to_fix.UPPER_HEATH_THRESHOLD = \
-                    tile_to_fix.UPPER_HEATH_THRESHOLD[0], \
-                    globals()[tile_to_fix.UPPER_HEATH_THRESHOLD[1]]
-        if tile_to_fix.LOWER_HEATH_THRESHOLD:
-            if type(tile_to_fix.LOWER_HEATH_THRESHOLD[1]) == str:
-                tile_to_fix.LOWER_HEATH_THRESHOLD = \
-                    tile_to_fix.LOWER_HEATH_THRESHOLD[0], \
-                    globals()[tile_to_fix.LOWER_HEATH_THRESHOLD[1]]
-                    
+def get_threshold(heats: array, types: array, type_id: int) -> Tuple[int, Type[Tile] or None] or None:
+    if types[type_id] < 0:
+        return None
+    return heats[type_id], TILE_TYPES[types[type_id] - 1] if types[type_id] else None
+
+
+def compile_materials(path: str):
+    """ creates a tile type for every material of the spec file and fills the property tables """
+    with open(path) as spec_file:
+        materials = json.load(spec_file)
+    tile_types = {}
+    # the type ids and the palette follow the order of the spec
+    for material in materials:
+        class_name = material["class"]
+        if "kind" in material:
+            tile_type = type(class_name, (MATERIAL_KINDS[material["kind"]],), {})
+            # some materials are referred to by their class name in the code (e.g. SmokeTile)
+            globals()[class_name] = tile_type
+        else:
+            tile_type = globals()[class_name]
+        TILE_TYPES.append(tile_type)
+        tile_types[class_name] = tile_type
+        tile_type.TYPE_ID = len(TILE_TYPES)
+        tile_type.NAME = material["name"]
+        tile_type.PALETTE_BASE = len(PALETTE)
+        base = material["color"]
+        jitter = material["color_jitter"]
+        for _ in range(PALETTE_VARIANTS):
+            PALETTE.append(tuple(
+                base[channel] + (randint(jitter[channel]) if jitter[channel] else 0) for channel in range(3)
+            ))
+        if material.get("selectable", True):
+            TILES.append(tile_type)
+    assert len(PALETTE) <= 256, "the palette indices must fit in a byte"
+    for material in materials:
+        tile_type = tile_types[material["class"]]
+        type_id = tile_type.TYPE_ID
+        DENSITY.append(material["density"])
+        BASE_HEAT.append(material.get("base_heat", 25))
+        BASE_HEAT_JITTER.append(material.get("base_heat_jitter", 0))
+        HEAT_TRANSFER_COEFFICIENT.append(material.get("heat_transfer_coefficient", 1))
+        PASSIVE_HEAT_LOSS.append(material.get("passive_heat_loss", 0))
+        for key, heats, types in (
+                ("upper_threshold", UPPER_THRESHOLD_HEAT, UPPER_THRESHOLD_TYPE),
+                ("lower_threshold", LOWER_THRESHOLD_HEAT, LOWER_THRESHOLD_TYPE)
+        ):
+            threshold = material.get(key)
+            if threshold and not issubclass(tile_type, HeatTile):
+                raise ValueError(f"{material['name']} has a {key} but does not transmit heat")
+            heats.append(threshold["heat"] if threshold else 0)
+            if not threshold:
+                types.append(-1)
+            else:
+                types.append(tile_types[threshold["becomes"]].TYPE_ID if threshold["becomes"] else 0)
+        # the systems read the properties of a tile from its class, the tables are the reference
+        tile_type.density = DENSITY[type_id]
+        if issubclass(tile_type, HeatTile):
+            tile_type.heat_transfer_coefficient = HEAT_TRANSFER_COEFFICIENT[type_id]
+            tile_type.passive_heath_loss = PASSIVE_HEAT_LOSS[type_id]
+            tile_type.UPPER_HEATH_THRESHOLD = get_threshold(UPPER_THRESHOLD_HEAT, UPPER_THRESHOLD_TYPE, type_id)
+            tile_type.LOWER_HEATH_THRESHOLD = get_threshold(LOWER_THRESHOLD_HEAT, LOWER_THRESHOLD_TYPE, type_id)
+            # optimize threshold check
+            if tile_type.UPPER_HEATH_THRESHOLD and tile_type.LOWER_HEATH_THRESHOLD:
+                tile_type.check_thresholds = HeatTile.check_both_thresholds
+            elif tile_type.UPPER_HEATH_THRESHOLD:
+                tile_type.check_thresholds = HeatTile.check_upper_threshold
+            elif tile_type.LOWER_HEATH_THRESHOLD:
+                tile_type.check_thresholds = HeatTile.check_lower_threshold
+            else:
+                tile_type.check_thresholds = HeatTile.check_no_threshold
+
+
+compile_materials(MATERIALS_FILE)
+
 #############################
 #---------- Main ------------
 #############################
 
-pygame.init()
-
-FONT = pygame.font.Font("font.ttf", 18)
-SMALL_FONT = pygame.font.Font("font.ttf", 14)
-
 # Game Setup
 FPS = 60
 fpsClock = pygame.time.Clock()
-WINDOW = pygame.display.set_mode((1280, 720), pygame.RESIZABLE)
-pygame.display.set_caption("SandBox")
-
-paused_text = FONT.render("SIMULATION PAUSED", False, (255, 255, 255))
-
-
-def render(world: World, selected_tile: int, mouse_position: Tuple[int, int], paused: bool, tiles_info: bool):
-    # set window caption (show FPS)
-    pygame.display.set_caption(f"Charb's SandBox")
-    # render world
-    surface = pygame.Surface((world.width, world.height))
-    for tile in world.tiles:
-        surface.set_at((tile.x, tile.y), tile.color)
-    surface.set_at(mouse_position, (255, 255, 255))
-    scaled_surface = pygame.transform.scale(surface, WINDOW.get_size())
-    # render selected tile
-    tile_text = FONT.render(f"selected ({selected_tile + 1}/{len(TILES)}): {TILES[selected_tile].NAME}".capitalize(), False, (255, 255, 255))
-    scaled_surface.blit(tile_text, (10, 10))
-    # render additional information if tiles info is on
-    if tiles_info:
-        total_particles_text = FONT.render(f"Total tiles: {len(world.tiles)}".capitalize(), False, (255, 255, 255))
-        scaled_surface.blit(total_particles_text, (10, 50))
-        tile = world.spatial_matrix[mouse_position[1]][mouse_position[0]]
-        if tile:
-            mouse_pos = pygame.mouse.get_pos()
-            tile_type_text = SMALL_FONT.render(
-                f"Type: {tile.NAME}".capitalize(),
-                False,
-                (255, 255, 255)
-            )
-            tile_type_text_shadow = SMALL_FONT.render(
-                f"Type: {tile.NAME}".capitalize(),
-                False,
-                (0, 0, 0)
-            )
-            scaled_surface.blit(tile_type_text_shadow, (mouse_pos[0] + 12, mouse_pos[1] + 2))
-            scaled_surface.blit(tile_type_text, (mouse_pos[0] + 10, mouse_pos[1]))
-            if "heat" in tile.__dict__:
-                tile_heat_text = SMALL_FONT.render(
-                    f"Heat: {tile.heat}".capitalize(),
-                    False,
-                    (255, 255, 255)
-                )
-                tile_heat_text_shadow = SMALL_FONT.render(
-                    f"Heat: {tile.heat}".capitalize(),
-                    False,
-                    (0, 0, 0)
-                )
-                scaled_surface.blit(tile_heat_text_shadow, (mouse_pos[0] + 12, mouse_pos[1] + 22))
-                scaled_surface.blit(tile_heat_text, (mouse_pos[0] + 10, mouse_pos[1] + 20))
-    # render pause text if the simulation is paused
-    if paused:
-        scaled_surface.blit(paused_text, (WINDOW.get_width() - paused_text.get_width() - 10, 10))
-    # render surface to window
-    WINDOW.blit(scaled_surface, (0, 0))
-    pygame.display.flip()
+
+# created by init_window, so importing the module (e.g. from the simulation server) opens no window
+FONT: pygame.font.Font
+SMALL_FONT: pygame.font.Font
+WINDOW: pygame.Surface
+
+WORLD_SIZE = 160, 90
+# time a tick may take before the simulation starts to lower its fidelity
+TICK_BUDGET = 0.5 / FPS
+# cells simulated around the camera view when the region of interest mode is on
+ROI_MARGIN = 32
+# chunks whose tiles are kept in memory when the world is backed by a chunk file
+MAX_RESIDENT_CHUNKS = 256
+
+
+def init_window():
+    global FONT, SMALL_FONT, WINDOW
+    pygame.init()
+    FONT = pygame.font.Font("font.ttf", 18)
+    SMALL_FONT = pygame.font.Font("font.ttf", 14)
+    WINDOW = pygame.display.set_mode((1280, 720), pygame.RESIZABLE)
+    pygame.display.set_caption("Charb's SandBox")
+
+
+class Camera:
+
+    # the default view shows at most this many cells, bigger worlds start zoomed in
+    DEFAULT_VIEW = 160, 90
+    # the view never gets narrower than this many cells
+    MIN_VIEW_WIDTH = 16
+    PAN_SPEED = 2
+
+    def __init__(self, world_width: int, world_height: int):
+        self.world_width = world_width
+        self.world_height = world_height
+        self.max_zoom = max(1.0, world_width / self.MIN_VIEW_WIDTH)
+        self.zoom: float = clamp(world_width / self.DEFAULT_VIEW[0], 1.0, self.max_zoom)
+        # top left corner of the view in world cells
+        self.x: int = 0
+        self.y: int = 0
+        self.clamp_position()
+
+    def get_view_size(self) -> Tuple[int, int]:
+        return max(1, int(self.world_width / self.zoom)), max(1, int(self.world_height / self.zoom))
+
+    def get_view_rect(self) -> Tuple[int, int, int, int]:
+        """ returns the visible cells as (x, y, width, height) """
+        return (self.x, self.y, *self.get_view_size())
+
+    def get_region(self, margin: int) -> Tuple[int, int, int, int]:
+        """ returns the visible cells grown by margin as (x0, y0, x1, y1) """
+        view_width, view_height = self.get_view_size()
+        return (
+            max(self.x - margin, 0),
+            max(self.y - margin, 0),
+            min(self.x + view_width + margin, self.world_width),
+            min(self.y + view_height + margin, self.world_height)
+        )
+
+    def get_cell_rect(self, x: int, y: int, window_size: Tuple[int, int]) -> Tuple[int, int, int, int]:
+        """ returns the area of the window covered by the given world cell """
+        # pygame.transform.scale shows the cell floor(pixel * view / window) at every pixel, so a cell
+        # starts at the pixel ceil(cell * window / view)
+        view_width, view_height = self.get_view_size()
+        left = -(-(x - self.x) * window_size[0] // view_width)
+        top = -(-(y - self.y) * window_size[1] // view_height)
+        right = -(-(x + 1 - self.x) * window_size[0] // view_width)
+        bottom = -(-(y + 1 - self.y) * window_size[1] // view_height)
+        return left, top, right - left, bottom - top
+
+    def clamp_position(self):
+        view_width, view_height = self.get_view_size()
+        self.x = clamp(self.x, 0, self.world_width - view_width)
+        self.y = clamp(self.y, 0, self.world_height - view_height)
+
+    def pan(self, dx: int, dy: int):
+        self.x += dx
+        self.y += dy
+        self.clamp_position()
+
+    def set_zoom(self, zoom: float, focus: Tuple[int, int]):
+        """ zooms while keeping the focused world cell at the same place on screen """
+        view_width, view_height = self.get_view_size()
+        focus_x = (focus[0] - self.x) / view_width
+        focus_y = (focus[1] - self.y) / view_height
+        self.zoom = clamp(zoom, 1.0, self.max_zoom)
+        view_width, view_height = self.get_view_size()
+        self.x = int(focus[0] - focus_x * view_width)
+        self.y = int(focus[1] - focus_y * view_height)
+        self.clamp_position()
+
+
+class Renderer:
+
+    # keeps the scaled world between frames, so a frame only redraws and uploads the cells that changed
+
+    # above this share of changed cells in the view, the whole view is redrawn at once
+    FULL_REDRAW_RATIO = 0.25
+    WHITE = 255, 255, 255
+
+    def __init__(self):
+        # the visible part of the world scaled to the window, without any overlay
+        self.world_layer: pygame.Surface or None = None
+        self.world: World or None = None
+        self.view_rect: Tuple[int, int, int, int] or None = None
+        self.window_size: Tuple[int, int] or None = None
+        # overlays drawn during the last frame and the window areas they cover
+        self.overlays = None
+        self.overlay_rects: List[pygame.Rect] = []
+
+    def get_overlays(
+            self,
+            world: World,
+            camera: Camera,
+            selected_tile: int,
+            mouse_position: Tuple[int, int],
+            paused: bool,
+            tiles_info: bool,
+            recorder
+    ):
+        """ returns the texts (font, text, color, position) and the highlighted cells (color, x, y) to draw """
+        window_width = WINDOW.get_width()
+        view_x, view_y, view_width, view_height = camera.get_view_rect()
+        cells = [
+            ((255, 255, 0), x, y) for x, y in world.area_effect_system.get_wave_cells()
+            if view_x <= x < view_x + view_width and view_y <= y < view_y + view_height
+        ]
+        cells.append((self.WHITE, mouse_position[0], mouse_position[1]))
+        # render selected tile
+        texts = [
+            (FONT, f"selected ({selected_tile + 1}/{len(TILES)}): {TILES[selected_tile].NAME}".capitalize(), self.WHITE, (10, 10))
+        ]
+        # render additional information if tiles info is on
+        if tiles_info:
+            texts.append((FONT, f"Total tiles: {len(world.tiles)}".capitalize(), self.WHITE, (10, 50)))
+            texts.append((
+                FONT,
+                f"Zoom: x{camera.zoom:.1f} region of interest: {'on' if world.simulation_region else 'off'}".capitalize(),
+                self.WHITE,
+                (10, 90)
+            ))
+            texts.append((
+                FONT,
+                f"Load level: {world.scheduler.level}/{TickScheduler.MAX_LEVEL} "
+                f"({world.scheduler.last_tick_time * 1000:.1f} ms per tick)".capitalize(),
+                self.WHITE,
+                (10, 130)
+            ))
+            tile = world.spatial_matrix[mouse_position[1]][mouse_position[0]]
+            if tile:
+                mouse_pos = pygame.mouse.get_pos()
+                texts.append((SMALL_FONT, f"Type: {tile.NAME}".capitalize(), (0, 0, 0), (mouse_pos[0] + 12, mouse_pos[1] + 2)))
+                texts.append((SMALL_FONT, f"Type: {tile.NAME}".capitalize(), self.WHITE, (mouse_pos[0] + 10, mouse_pos[1])))
+                if "heat" in tile.__dict__:
+                    texts.append((SMALL_FONT, f"Heat: {tile.heat}".capitalize(), (0, 0, 0), (mouse_pos[0] + 12, mouse_pos[1] + 22)))
+                    texts.append((SMALL_FONT, f"Heat: {tile.heat}".capitalize(), self.WHITE, (mouse_pos[0] + 10, mouse_pos[1] + 20)))
+        # render pause text if the simulation is paused
+        if paused:
+            paused_text = "SIMULATION PAUSED"
+            texts.append((FONT, paused_text, self.WHITE, (window_width - FONT.size(paused_text)[0] - 10, 10)))
+        if recorder:
+            if recorder.error is not None:
+                recording_text = "RECORDING FAILED"
+            else:
+                recording_text = f"Recording ({recorder.dropped_frames} dropped)".upper()
+            texts.append((FONT, recording_text, (255, 0, 0), (window_width - FONT.size(recording_text)[0] - 10, 50)))
+        return texts, cells
+
+    def redraw_world(self, world: World, camera: Camera, window_size: Tuple[int, int]) -> List[pygame.Rect] or None:
+        """ redraws the changed cells on the world layer and returns their window areas, None after a full redraw """
+        view_rect = camera.get_view_rect()
+        view_x, view_y, view_width, view_height = view_rect
+        dirty_cells = world.dirty_cells
+        world.dirty_cells = set()
+        if (
+                world is not self.world
+                or view_rect != self.view_rect
+                or window_size != self.window_size
+                or dirty_cells is None
+                or len(dirty_cells) > self.FULL_REDRAW_RATIO * view_width * view_height
+        ):
+            self.world = world
+            self.view_rect = view_rect
+            self.window_size = window_size
+            # the color matrix is read as a palettized image
+            world_surface = pygame.image.frombuffer(world.color_matrix, (world.width, world.height), "P")
+            world_surface.set_palette(PALETTE)
+            self.world_layer = pygame.transform.scale(world_surface.subsurface(view_rect), window_size)
+            return None
+        # merge the changed cells of every row into runs, the cells are filled one by one with the same
+        # mapping as the full redraw and every run is uploaded as one rect
+        rows = {}
+        for cell in dirty_cells:
+            y, x = divmod(cell, world.width)
+            if view_x <= x < view_x + view_width and view_y <= y < view_y + view_height:
+                rows.setdefault(y, []).append(x)
+        rects = []
+        for y, xs in rows.items():
+            xs.sort()
+            start = previous = xs[0]
+            for x in chain(xs[1:], (None,)):
+                if x == previous + 1:
+                    previous = x
+                    continue
+                left, top, _, height = camera.get_cell_rect(start, y, window_size)
+                last_left, _, last_width, _ = camera.get_cell_rect(previous, y, window_size)
+                rect = pygame.Rect(left, top, last_left + last_width - left, height)
+                if rect.width and rect.height:
+                    row_offset = y * world.width
+                    for cell_x in range(start, previous + 1):
+                        cell_rect = camera.get_cell_rect(cell_x, y, window_size)
+                        if cell_rect[2]:
+                            self.world_layer.fill(PALETTE[world.color_matrix[row_offset + cell_x]], cell_rect)
+                    rects.append(rect)
+                start = previous = x
+        return rects
+
+    def render(
+            self,
+            world: World,
+            camera: Camera,
+            selected_tile: int,
+            mouse_position: Tuple[int, int],
+            paused: bool,
+            tiles_info: bool,
+            recorder=None
+    ):
+        window_size = WINDOW.get_size()
+        overlays = self.get_overlays(world, camera, selected_tile, mouse_position, paused, tiles_info, recorder)
+        world_rects = self.redraw_world(world, camera, window_size)
+        if world_rects == [] and overlays == self.overlays:
+            # nothing changed since the last frame
+            return
+        if world_rects is None:
+            WINDOW.blit(self.world_layer, (0, 0))
+        else:
+            # put the world back under the last overlays and copy the changed cells
+            for rect in chain(self.overlay_rects, world_rects):
+                WINDOW.blit(self.world_layer, rect, rect)
+        texts, cells = overlays
+        overlay_rects = []
+        for color, x, y in cells:
+            overlay_rects.append(WINDOW.fill(color, camera.get_cell_rect(x, y, window_size)))
+        for font, text, color, position in texts:
+            overlay_rects.append(WINDOW.blit(font.render(text, False, color), position))
+        if world_rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.overlay_rects + world_rects + overlay_rects)
+        self.overlays = overlays
+        self.overlay_rects = overlay_rects
 
 
 def clamp(n, smallest, largest) -> int:
@@ -913,26 +1653,37 @@ def clamp(n, smallest, largest) -> int:
     return ll[1]
 
 
-def get_mouse_world_position(world: World) -> Tuple[int, int]:
+def get_mouse_world_position(world: World, camera: Camera) -> Tuple[int, int]:
     window_size = WINDOW.get_size()
     mouse_pos = pygame.mouse.get_pos()
-    mouse_x = clamp(int((mouse_pos[0] / window_size[0]) * world.width), 0, world.width - 1)
-    mouse_y = clamp(int((mouse_pos[1] / window_size[1]) * world.height), 0, world.height - 1)
+    view_x, view_y, view_width, view_height = camera.get_view_rect()
+    mouse_x = clamp(view_x + int((mouse_pos[0] / window_size[0]) * view_width), 0, world.width - 1)
+    mouse_y = clamp(view_y + int((mouse_pos[1] / window_size[1]) * view_height), 0, world.height - 1)
     return mouse_x, mouse_y
 
 
 def main():
-    world = World(160, 90)
+    init_window()
+    # the world size can be given on the command line: SandBox.py <width> <height> [chunk file]
+    world_size = (int(sys.argv[1]), int(sys.argv[2])) if len(sys.argv) >= 3 else WORLD_SIZE
+    chunk_file = sys.argv[3] if len(sys.argv) >= 4 else None
+    world = World(*world_size, tick_budget=TICK_BUDGET, chunk_file=chunk_file, max_resident_chunks=MAX_RESIDENT_CHUNKS)
+    camera = Camera(*world_size)
     selected_tile: int = 0
     pause: bool = False
     tiles_info: bool = False
+    region_of_interest: bool = False
+    recorder = None
+    renderer = Renderer()
 
     while True:
         # Get mouse position
-        mouse_position = get_mouse_world_position(world)
+        mouse_position = get_mouse_world_position(world, camera)
         # Get inputs
         for event in pygame.event.get():
             if event.type == QUIT:
+                if recorder:
+                    recorder.close()
                 pygame.quit()
                 sys.exit()
             if event.type == MOUSEWHEEL:
@@ -952,9 +1703,38 @@ def main():
                 elif event.scancode == 58:
                     # Press F1
                     tiles_info = not tiles_info
+                elif event.scancode == 59:
+                    # Press F2
+                    region_of_interest = not region_of_interest
+                elif event.scancode == 60:
+                    # Press F3
+                    if recorder:
+                        recorder.close()
+                        recorder = None
+                    else:
+                        try:
+                            recorder = FrameRecorder(
+                                f"capture_{int(time())}.sbx", world.width, world.height, PALETTE
+                            )
+                        except OSError as error:
+                            print(f"Cannot record: {error}")
                 elif event.scancode == 41:
                     # Press ESC
-                    world = World(160, 90)
+                    if world.pager:
+                        world.pager.close()
+                    world = World(
+                        *world_size, tick_budget=TICK_BUDGET, chunk_file=chunk_file, max_resident_chunks=MAX_RESIDENT_CHUNKS
+                    )
+                elif event.unicode in ("+", "="):
+                    camera.set_zoom(camera.zoom * 2, mouse_position)
+                elif event.unicode == "-":
+                    camera.set_zoom(camera.zoom / 2, mouse_position)
+        # move the camera
+        pressed_keys = pygame.key.get_pressed()
+        camera.pan(
+            (pressed_keys[K_RIGHT] - pressed_keys[K_LEFT]) * Camera.PAN_SPEED,
+            (pressed_keys[K_DOWN] - pressed_keys[K_UP]) * Camera.PAN_SPEED
+        )
         if pygame.mouse.get_pressed()[0]:
             world.add_tile(TILES[selected_tile], mouse_position[0], mouse_position[1])
             if pygame.key.get_pressed()[K_LCTRL]:
@@ -973,10 +1753,15 @@ def main():
                         mouse_position[1] + direction[1]
                     )
         # update physics
+        world.simulation_region = camera.get_region(ROI_MARGIN) if region_of_interest else None
+        if world.pager:
+            world.pager.focus_region = camera.get_region(ROI_MARGIN)
         if not pause:
             world.update()
+            if recorder:
+                recorder.capture(world.update_count, world.color_matrix)
         # render
-        render(world, selected_tile, mouse_position, pause, tiles_info)
+        renderer.render(world, camera, selected_tile, mouse_position, pause, tiles_info, recorder)
         fpsClock.tick(FPS)
 
 
@@ -0,0 +1,248 @@
+"""
+Records the world frames from a background thread, so encoding never blocks the simulation loop.
+
+A recording is either a sequence of palettized PNG files (one per frame) or a stream file holding a keyframe every
+KEYFRAME_INTERVAL frames and delta frames (only the changed cells) in between.
+Run `python capture.py convert <stream file> <png directory>` to turn a stream into a PNG sequence.
+"""
+import os
+import queue
+import struct
+import sys
+import threading
+import zlib
+from typing import Iterator, List, Tuple
+
+# the frame is dropped when the queue is full
+DROP = "drop"
+# the simulation waits for the encoder when the queue is full
+THROTTLE = "throttle"
+
+STREAM_MAGIC = b"SBXS"
+# width and height of the world, followed by the 256 colors of the palette
+STREAM_HEADER = struct.Struct("!II")
+# kind, tick and size of a frame, followed by the zlib compressed frame data
+STREAM_FRAME_HEADER = struct.Struct("!BII")
+KEYFRAME = 0
+DELTA = 1
+KEYFRAME_INTERVAL = 300
+
+# start cell and length of a run of changed cells in a delta frame, followed by the cells
+RUN_HEADER = struct.Struct("!II")
+# frames are compared in blocks of this many cells
+BLOCK_SIZE = 64
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def encode_delta(previous_frame: bytes, frame: bytes) -> bytes:
+    """ returns the runs of blocks that differ between two frames """
+    previous_view = memoryview(previous_frame)
+    view = memoryview(frame)
+    runs = bytearray()
+    run_start = None
+    for offset in range(0, len(frame), BLOCK_SIZE):
+        if view[offset:offset + BLOCK_SIZE] != previous_view[offset:offset + BLOCK_SIZE]:
+            if run_start is None:
+                run_start = offset
+        elif run_start is not None:
+            runs += RUN_HEADER.pack(run_start, offset - run_start) + view[run_start:offset]
+            run_start = None
+    if run_start is not None:
+        runs += RUN_HEADER.pack(run_start, len(frame) - run_start) + view[run_start:]
+    return bytes(runs)
+
+
+def apply_delta(frame: bytearray, runs: bytes):
+    offset = 0
+    while offset < len(runs):
+        run_start, run_length = RUN_HEADER.unpack_from(runs, offset)
+        offset += RUN_HEADER.size
+        frame[run_start:run_start + run_length] = runs[offset:offset + run_length]
+        offset += run_length
+
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack("!I", len(data)) + chunk_type + data + struct.pack("!I", zlib.crc32(chunk_type + data))
+
+
+def encode_png(frame: bytes, width: int, height: int, palette: List[Tuple[int, int, int]]) -> bytes:
+    """ returns a palettized PNG with one pixel per cell """
+    # every row starts with its filter type (0, no filter)
+    rows = b"".join(b"\0" + frame[y * width:(y + 1) * width] for y in range(height))
+    return (
+        PNG_SIGNATURE
+        + png_chunk(b"IHDR", struct.pack("!IIBBBBB", width, height, 8, 3, 0, 0, 0))
+        + png_chunk(b"PLTE", bytes(channel for color in palette for channel in color))
+        + png_chunk(b"IDAT", zlib.compress(rows))
+        + png_chunk(b"IEND", b"")
+    )
+
+
+def read_stream(path: str) -> Iterator[Tuple[int, bytes]]:
+    """ yields the tick and the color matrix of every frame of a stream file """
+    with open(path, "rb") as stream:
+        if stream.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+            raise ValueError(f"{path} is not a SandBox stream")
+        width, height = STREAM_HEADER.unpack(stream.read(STREAM_HEADER.size))
+        stream.read(256 * 3)
+        frame = bytearray(width * height)
+        while True:
+            header = stream.read(STREAM_FRAME_HEADER.size)
+            if len(header) < STREAM_FRAME_HEADER.size:
+                return
+            kind, tick, size = STREAM_FRAME_HEADER.unpack(header)
+            data = zlib.decompress(stream.read(size))
+            if kind == KEYFRAME:
+                frame[:] = data
+            else:
+                apply_delta(frame, data)
+            yield tick, bytes(frame)
+
+
+def read_stream_palette(path: str) -> Tuple[int, int, List[Tuple[int, int, int]]]:
+    """ returns the world size and the palette of a stream file """
+    with open(path, "rb") as stream:
+        stream.read(len(STREAM_MAGIC))
+        width, height = STREAM_HEADER.unpack(stream.read(STREAM_HEADER.size))
+        colors = stream.read(256 * 3)
+    return width, height, [tuple(colors[index:index + 3]) for index in range(0, len(colors), 3)]
+
+
+class FrameRecorder:
+
+    # capture() only copies the frame into a bounded queue, the encoder thread does the rest
+    # seconds between two checks that the encoder thread is still there while waiting for room in the queue
+    WAIT_TIMEOUT = 0.1
+
+    def __init__(
+            self,
+            path: str,
+            width: int,
+            height: int,
+            palette: List[Tuple[int, int, int]],
+            png_sequence: bool = False,
+            max_queued_frames: int = 64,
+            policy: str = DROP
+    ):
+        # a directory for a PNG sequence, a file for a stream
+        self.path = path
+        self.width = width
+        self.height = height
+        self.palette = list(palette)
+        self.png_sequence = png_sequence
+        self.policy = policy
+        self.frames: queue.Queue = queue.Queue(max_queued_frames)
+        self.captured_frames: int = 0
+        self.dropped_frames: int = 0
+        self.encoded_frames: int = 0
+        # error that stopped the encoder, the frames captured after it are dropped
+        self.error: Exception or None = None
+        # the destination is created here so that an unusable path is reported to the caller
+        self._stream = None
+        if png_sequence:
+            os.makedirs(path, exist_ok=True)
+        else:
+            self._stream = open(path, "wb")
+            try:
+                palette = self.palette + [(0, 0, 0)] * (256 - len(self.palette))
+                self._stream.write(STREAM_MAGIC + STREAM_HEADER.pack(width, height))
+                self._stream.write(bytes(channel for color in palette for channel in color))
+            except OSError:
+                self._stream.close()
+                raise
+        self._encoder = threading.Thread(target=self.encode_frames, daemon=True)
+        self._encoder.start()
+
+    def put(self, item) -> bool:
+        """ waits for room in the queue, gives up if the encoder thread is gone """
+        while self._encoder.is_alive():
+            try:
+                self.frames.put(item, timeout=self.WAIT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def capture(self, tick: int, color_matrix: bytearray):
+        """ queues a copy of the frame, drops it or waits for the encoder when the queue is full """
+        if self.error is not None:
+            self.dropped_frames += 1
+            return
+        frame = (tick, bytes(color_matrix))
+        if self.policy == THROTTLE:
+            if not self.put(frame):
+                self.dropped_frames += 1
+                return
+        else:
+            try:
+                self.frames.put_nowait(frame)
+            except queue.Full:
+                self.dropped_frames += 1
+                return
+        self.captured_frames += 1
+
+    def encode_frame(self, tick: int, data: bytes, previous_frame: bytes or None):
+        if self.png_sequence:
+            with open(os.path.join(self.path, f"frame_{tick:08d}.png"), "wb") as png_file:
+                png_file.write(encode_png(data, self.width, self.height, self.palette))
+        else:
+            if previous_frame is None or self.encoded_frames % KEYFRAME_INTERVAL == 0:
+                kind, payload = KEYFRAME, zlib.compress(data)
+            else:
+                kind, payload = DELTA, zlib.compress(encode_delta(previous_frame, data))
+            self._stream.write(STREAM_FRAME_HEADER.pack(kind, tick, len(payload)) + payload)
+
+    def encode_frames(self):
+        previous_frame = None
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                # the queue is still drained so that capture() and close() never wait on it
+                continue
+            tick, data = frame
+            try:
+                self.encode_frame(tick, data, previous_frame)
+            except Exception as error:
+                self.error = error
+                continue
+            previous_frame = data
+            self.encoded_frames += 1
+        if self._stream:
+            try:
+                self._stream.close()
+            except OSError as error:
+                self.error = self.error or error
+
+    def close(self):
+        """ waits for the queued frames to be encoded """
+        self.put(None)
+        self._encoder.join()
+
+
+def record_offline(world, ticks: int, recorder: FrameRecorder):
+    """ runs the world for the given number of ticks without any window, a THROTTLE recorder keeps every frame """
+    for _ in range(ticks):
+        world.update()
+        recorder.capture(world.update_count, world.color_matrix)
+
+
+def convert(stream_path: str, directory: str):
+    width, height, palette = read_stream_palette(stream_path)
+    os.makedirs(directory, exist_ok=True)
+    for tick, frame in read_stream(stream_path):
+        with open(os.path.join(directory, f"frame_{tick:08d}.png"), "wb") as png_file:
+            png_file.write(encode_png(frame, width, height, palette))
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] != "convert":
+        print(__doc__)
+        sys.exit(1)
+    convert(sys.argv[2], sys.argv[3])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Conformance suite: steps the reference engine and a candidate engine side by side on random seeded worlds and
+reports the first tick and cell where they diverge, then checks that two runs of the candidate on the same world
+stay identical and checks the physics invariants of the candidate.
+
+Run `python conformance.py [module:factory] [seeds] [ticks]`, the factory is called with the world width and height
+and returns a World (e.g. a World subclass with faster systems). Without a candidate the reference is checked
+against itself, which makes sure the suite itself is deterministic.
+"""
+import importlib
+import random
+import sys
+from typing import Callable, List, Tuple
+
+import semirandom
+from SandBox import (
+    ConcreteTile, GlassTile, HeatTile, OilTile, RockTile, SandTile, TILES, Tile, WaterTile, World, find_divergence
+)
+
+WORLD_SIZE = 64, 48
+SEEDS = 20
+TICKS = 300
+
+# a bar of sand boxed in concrete, hot at one end, has evened out after DIFFUSION_TICKS ticks
+DIFFUSION_BAR = 60
+DIFFUSION_TICKS = 3000
+DIFFUSION_SPREAD = 4
+
+# these materials only move, nothing they do changes their heat
+MOVEMENT_MATERIALS = (SandTile, RockTile, WaterTile, OilTile)
+# these materials have no threshold and no passive heat loss, their total heat never changes
+HEAT_MATERIALS = (ConcreteTile, GlassTile)
+
+Engine = Callable[[int, int], World]
+# tile type, x, y and heat (None keeps the base heat) of every tile of a scene
+Scene = List[Tuple[type, int, int, int or None]]
+
+
+def load_engine(name: str) -> Engine:
+    """ returns the engine of a module:factory name """
+    module_name, factory_name = name.split(":")
+    return getattr(importlib.import_module(module_name), factory_name)
+
+
+def generate_scene(seed: int, materials, heat_range: Tuple[int, int] or None = None) -> Scene:
+    """ returns a random scene made of blobs of the given materials """
+    rng = random.Random(seed)
+    width, height = WORLD_SIZE
+    cells = {}
+    for _ in range(rng.randint(4, 12)):
+        material = rng.choice(materials)
+        center_x = rng.randrange(width)
+        center_y = rng.randrange(height)
+        radius = rng.randint(2, 8)
+        for y in range(max(center_y - radius, 0), min(center_y + radius + 1, height)):
+            for x in range(max(center_x - radius, 0), min(center_x + radius + 1, width)):
+                if (x - center_x) ** 2 + (y - center_y) ** 2 <= radius ** 2 and rng.random() < 0.8:
+                    heat = rng.randint(*heat_range) if heat_range else None
+                    cells[(x, y)] = (material, heat)
+    return [(material, x, y, heat) for (x, y), (material, heat) in sorted(cells.items())]
+
+
+def build_world(engine: Engine, scene: Scene, cursor: int) -> World:
+    semirandom.CURSOR = cursor
+    world = engine(*WORLD_SIZE)
+    for material, x, y, heat in scene:
+        tile = world.add_tile(material, x, y)
+        if heat is not None:
+            tile.change_heat(heat - tile.heat)
+    return world
+
+
+def describe_cell(world: World, x: int, y: int) -> str:
+    tile = world.spatial_matrix[y][x]
+    if not tile:
+        return "empty"
+    if isinstance(tile, HeatTile):
+        return f"{tile.NAME} (heat {tile.heat}, color {tile.color_index})"
+    return f"{tile.NAME} (color {tile.color_index})"
+
+
+def get_cell_state(tile: Tile or None):
+    if not tile:
+        return None
+    return tile.TYPE_ID, tile.color_index, getattr(tile, "heat", None)
+
+
+def find_diverging_cell(reference: World, candidate: World) -> Tuple[int, int] or None:
+    for y, (reference_row, candidate_row) in enumerate(zip(reference.spatial_matrix, candidate.spatial_matrix)):
+        for x, (reference_tile, candidate_tile) in enumerate(zip(reference_row, candidate_row)):
+            if get_cell_state(reference_tile) != get_cell_state(candidate_tile):
+                return x, y
+    return None
+
+
+def compare_engines(candidate_engine: Engine, scene: Scene, ticks: int, cursor: int) -> str or None:
+    """ steps both engines side by side, returns a description of the first divergence """
+    reference = build_world(World, scene, cursor)
+    candidate = build_world(candidate_engine, scene, cursor)
+    if find_diverging_cell(reference, candidate):
+        return "the worlds differ before the first tick"
+    for tick in range(ticks):
+        # both engines start every tick from the same point of the random sequence
+        tick_cursor = semirandom.CURSOR
+        reference.update()
+        reference_cursor = semirandom.CURSOR
+        semirandom.CURSOR = tick_cursor
+        candidate.update()
+        semirandom.CURSOR = reference_cursor
+        # the hash only sees heat buckets, so the cells are compared on every tick to catch any heat difference
+        cell = find_diverging_cell(reference, candidate)
+        if cell:
+            x, y = cell
+            return (
+                f"tick {tick}, cell ({x}, {y}): "
+                f"reference {describe_cell(reference, x, y)}, candidate {describe_cell(candidate, x, y)}"
+            )
+        if reference.world_hash != candidate.world_hash:
+            return f"tick {tick}: the world hashes differ but every cell matches"
+    return None
+
+
+def run_recorded(engine: Engine, scene: Scene, ticks: int, cursor: int) -> List[int]:
+    """ runs a world on its own and returns the world hash at the end of every tick """
+    world = build_world(engine, scene, cursor)
+    world.hash_history = []
+    for _ in range(ticks):
+        world.update()
+    return world.hash_history
+
+
+def check_determinism(engine: Engine, scene: Scene, ticks: int, cursor: int) -> str or None:
+    """ two runs of the same world from the same point of the random sequence never diverge """
+    tick = find_divergence(run_recorded(engine, scene, ticks, cursor), run_recorded(engine, scene, ticks, cursor))
+    if tick is not None:
+        return f"tick {tick}: two runs of the same world diverge"
+    return None
+
+
+def count_tiles(world: World) -> dict:
+    counts = {}
+    for tile in world.tiles:
+        counts[tile.NAME] = counts.get(tile.NAME, 0) + 1
+    return counts
+
+
+def check_tile_conservation(engine: Engine, scene: Scene, ticks: int, cursor: int) -> str or None:
+    """ tiles that only move are never created nor destroyed """
+    world = build_world(engine, scene, cursor)
+    counts = count_tiles(world)
+    for tick in range(ticks):
+        world.update()
+        if count_tiles(world) != counts:
+            return f"tick {tick}: {counts} tiles became {count_tiles(world)}"
+    return None
+
+
+def check_heat_conservation(engine: Engine, scene: Scene, ticks: int, cursor: int) -> str or None:
+    """ heat exchanges between tiles without thresholds nor passive loss keep the total heat """
+    world = build_world(engine, scene, cursor)
+    total_heat = sum(tile.heat for tile in world.heat_tiles)
+    for tick in range(ticks):
+        world.update()
+        new_total_heat = sum(tile.heat for tile in world.heat_tiles)
+        if new_total_heat != total_heat:
+            return f"tick {tick}: the total heat went from {total_heat} to {new_total_heat}"
+    return None
+
+
+def generate_bar_scene() -> Scene:
+    """ returns a bar of sand in a concrete box, with its first cells much hotter than the rest """
+    scene = [(ConcreteTile, x, y, None) for y in (1, 3) for x in range(DIFFUSION_BAR + 2)]
+    scene += [(ConcreteTile, 0, 2, None), (ConcreteTile, DIFFUSION_BAR + 1, 2, None)]
+    scene += [(SandTile, x, 2, 700 if x <= 10 else None) for x in range(1, DIFFUSION_BAR + 1)]
+    return scene
+
+
+def check_heat_diffusion(engine: Engine, scene: Scene, ticks: int, cursor: int) -> str or None:
+    """ tiles keep exchanging heat until their neighbours are at the same temperature """
+    world = build_world(engine, scene, cursor)
+    for _ in range(ticks):
+        world.update()
+    heats = [tile.heat for tile in world.heat_tiles if isinstance(tile, SandTile)]
+    if max(heats) - min(heats) > DIFFUSION_SPREAD:
+        return f"after {ticks} ticks the heat of the bar still goes from {max(heats)} to {min(heats)}"
+    return None
+
+
+def run_suite(candidate_engine: Engine, seeds: int = SEEDS, ticks: int = TICKS) -> int:
+    """ runs every check for every seed, prints the failures and returns how many there were """
+    failures = 0
+    for seed in range(seeds):
+        cursor = seed % len(semirandom.NUMBERS)
+        checks = (
+            ("differential", compare_engines, generate_scene(seed, TILES)),
+            ("determinism", check_determinism, generate_scene(seed, TILES)),
+            ("tile conservation", check_tile_conservation, generate_scene(seed, MOVEMENT_MATERIALS)),
+            ("heat conservation", check_heat_conservation, generate_scene(seed, HEAT_MATERIALS, (-1000, 3000)))
+        )
+        for name, check, scene in checks:
+            failure = check(candidate_engine, scene, ticks, cursor)
+            if failure:
+                failures += 1
+                print(f"seed {seed} {name}: {failure}")
+    failure = check_heat_diffusion(candidate_engine, generate_bar_scene(), DIFFUSION_TICKS, 0)
+    if failure:
+        failures += 1
+        print(f"heat diffusion: {failure}")
+    print(f"{seeds} seeds, {ticks} ticks: {failures} failure(s)")
+    return failures
+
+
+def main():
+    candidate_engine = load_engine(sys.argv[1]) if len(sys.argv) >= 2 else World
+    seeds = int(sys.argv[2]) if len(sys.argv) >= 3 else SEEDS
+    ticks = int(sys.argv[3]) if len(sys.argv) >= 4 else TICKS
+    sys.exit(1 if run_suite(candidate_engine, seeds, ticks) else 0)
+
+
+if __name__ == "__main__":
+    main()
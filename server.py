@@ -0,0 +1,363 @@
+"""
+Headless simulation server: runs a World without a window and streams its frames to the attached clients.
+
+Run `python server.py serve [address] [width height]` to start a server and `python server.py view [address]`
+to attach a viewer to it. An address is host:port (localhost:5050 by default) or unix:<socket path>.
+
+Every message is a 4 bytes big endian length followed by its payload:
+- the server first sends a JSON hello (world size, palette and selectable tiles) and a keyframe
+- then one delta frame per tick holding only the blocks of cells that changed since the last frame sent
+- clients send JSON edits: {"type": "add", "tile": <tile name>, "x": x, "y": y}, {"type": "delete", "x": x, "y": y},
+  {"type": "pause"} and {"type": "resume"}
+"""
+import json
+import os
+import queue
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+import zlib
+from time import perf_counter, sleep
+from typing import List, Tuple
+
+from capture import apply_delta, encode_delta
+from SandBox import PALETTE, TILES, World, WORLD_SIZE
+
+DEFAULT_ADDRESS = "localhost:5050"
+TICKS_PER_SECOND = 60
+
+MESSAGE_HEADER = struct.Struct("!I")
+# kind and tick of a frame, followed by the zlib compressed frame data
+FRAME_HEADER = struct.Struct("!BI")
+KEYFRAME = 0
+DELTA = 1
+
+
+def parse_address(address: str) -> Tuple[int, str or Tuple[str, int]]:
+    """ returns the socket family and address of a host:port or unix:<path> address """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, port = address.rsplit(":", 1)
+    return socket.AF_INET, (host, int(port))
+
+
+def send_message(connection: socket.socket, payload: bytes):
+    connection.sendall(MESSAGE_HEADER.pack(len(payload)) + payload)
+
+
+def receive_exactly(connection: socket.socket, size: int) -> bytes or None:
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def receive_message(connection: socket.socket) -> bytes or None:
+    """ returns the next message, None once the connection is closed """
+    header = receive_exactly(connection, MESSAGE_HEADER.size)
+    if header is None:
+        return None
+    return receive_exactly(connection, MESSAGE_HEADER.unpack(header)[0])
+
+
+class Simulation:
+
+    # owns the world, only the tick thread touches it
+
+    def __init__(self, world: World, ticks_per_second: float = TICKS_PER_SECOND):
+        self.world = world
+        # 0 runs the ticks as fast as possible
+        self.ticks_per_second = ticks_per_second
+        self.paused: bool = False
+        self.running: bool = True
+        # edits sent by the clients, applied between two ticks
+        self.edits: queue.Queue = queue.Queue()
+        self.tile_types = {tile_type.NAME: tile_type for tile_type in TILES}
+        # latest frame (frame number, tick, color matrix copy), the clients wait on the condition for the next one
+        self.frame_condition = threading.Condition()
+        self.frame: Tuple[int, int, bytes] = (0, world.update_count, bytes(world.color_matrix))
+
+    def push_edit(self, edit: dict):
+        self.edits.put(edit)
+
+    def apply_edits(self) -> bool:
+        """ applies the pending edits, returns whether there were any """
+        world = self.world
+        if self.edits.empty():
+            return False
+        while not self.edits.empty():
+            edit = self.edits.get()
+            edit_type = edit.get("type")
+            if edit_type == "pause":
+                self.paused = True
+            elif edit_type == "resume":
+                self.paused = False
+            elif edit_type in ("add", "delete"):
+                x = edit.get("x")
+                y = edit.get("y")
+                if not (isinstance(x, int) and isinstance(y, int) and 0 <= x < world.width and 0 <= y < world.height):
+                    continue
+                if edit_type == "delete":
+                    world.delete_tile(x, y)
+                elif edit.get("tile") in self.tile_types:
+                    world.add_tile(self.tile_types[edit["tile"]], x, y)
+        return True
+
+    def publish_frame(self):
+        with self.frame_condition:
+            self.frame = (self.frame[0] + 1, self.world.update_count, bytes(self.world.color_matrix))
+            self.frame_condition.notify_all()
+
+    def wait_frame(self, last_frame_number: int, timeout: float) -> Tuple[int, int, bytes] or None:
+        """ returns the latest frame once it is newer than last_frame_number, None after timeout seconds """
+        with self.frame_condition:
+            if not self.frame_condition.wait_for(lambda: self.frame[0] != last_frame_number, timeout):
+                return None
+            return self.frame
+
+    def run(self):
+        while self.running:
+            start_time = perf_counter()
+            edited = self.apply_edits()
+            if not self.paused:
+                self.world.update()
+            if edited or not self.paused:
+                self.publish_frame()
+            if self.ticks_per_second:
+                sleep(max(0.0, 1 / self.ticks_per_second - (perf_counter() - start_time)))
+
+
+class ClientHandler(socketserver.BaseRequestHandler):
+
+    # clients that miss frames receive a delta from the last frame they got, slow clients never slow the tick
+
+    server: "SimulationServer"
+    # seconds between two checks of a closed connection while the simulation is paused
+    IDLE_TIMEOUT = 1
+
+    def setup(self):
+        self.closed = threading.Event()
+
+    def handle(self):
+        simulation = self.server.simulation
+        world = simulation.world
+        hello = {
+            "width": world.width,
+            "height": world.height,
+            "palette": PALETTE,
+            "tiles": [tile.NAME for tile in TILES]
+        }
+        try:
+            send_message(self.request, json.dumps(hello).encode())
+            threading.Thread(target=self.receive_edits, daemon=True).start()
+            frame_number, tick, previous_frame = simulation.frame
+            send_message(self.request, FRAME_HEADER.pack(KEYFRAME, tick) + zlib.compress(previous_frame))
+            while not self.closed.is_set():
+                frame = simulation.wait_frame(frame_number, self.IDLE_TIMEOUT)
+                if frame is None:
+                    continue
+                frame_number, tick, current_frame = frame
+                delta = encode_delta(previous_frame, current_frame)
+                send_message(self.request, FRAME_HEADER.pack(DELTA, tick) + zlib.compress(delta))
+                previous_frame = current_frame
+        except OSError:
+            # the client went away
+            pass
+
+    def receive_edits(self):
+        try:
+            while True:
+                message = receive_message(self.request)
+                if message is None:
+                    break
+                try:
+                    edit = json.loads(message)
+                except ValueError:
+                    continue
+                if isinstance(edit, dict):
+                    self.server.simulation.push_edit(edit)
+        except OSError:
+            pass
+        self.closed.set()
+
+
+class SimulationServer(socketserver.ThreadingMixIn, socketserver.BaseServer):
+
+    daemon_threads = True
+    simulation: Simulation
+
+
+class TCPSimulationServer(SimulationServer, socketserver.TCPServer):
+
+    allow_reuse_address = True
+
+
+class UnixSimulationServer(SimulationServer, socketserver.UnixStreamServer):
+
+    # path of the socket file created by this server, removed when it closes
+    socket_path: str or None = None
+
+    def server_bind(self):
+        # a socket file left behind by a server that did not close cleanly would make the bind fail
+        if is_stale_socket(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+        self.socket_path = self.server_address
+
+    def server_close(self):
+        super().server_close()
+        if self.socket_path:
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+            self.socket_path = None
+
+
+def is_stale_socket(path: str) -> bool:
+    """ tells if the path is a unix socket file nobody listens on anymore """
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return False
+    except FileNotFoundError:
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            return True
+    return False
+
+
+def start_server(simulation: Simulation, address: str) -> SimulationServer:
+    """ starts serving the simulation from a background thread, the ticks are still run by simulation.run """
+    family, socket_address = parse_address(address)
+    server_type = UnixSimulationServer if family == socket.AF_UNIX else TCPSimulationServer
+    server = server_type(socket_address, ClientHandler)
+    server.simulation = simulation
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class SimulationClient:
+
+    def __init__(self, address: str = DEFAULT_ADDRESS):
+        family, socket_address = parse_address(address)
+        self.connection = socket.socket(family, socket.SOCK_STREAM)
+        self.connection.connect(socket_address)
+        hello = json.loads(receive_message(self.connection))
+        self.width: int = hello["width"]
+        self.height: int = hello["height"]
+        self.palette: List[Tuple[int, int, int]] = [tuple(color) for color in hello["palette"]]
+        self.tiles: List[str] = hello["tiles"]
+        # palette index of every cell, row by row, as of the last frame received
+        self.frame = bytearray(self.width * self.height)
+        self.tick: int = -1
+
+    def receive_frame(self) -> bool:
+        """ waits for the next frame and applies it, returns False once the server is gone """
+        message = receive_message(self.connection)
+        if message is None:
+            return False
+        kind, self.tick = FRAME_HEADER.unpack_from(message)
+        data = zlib.decompress(message[FRAME_HEADER.size:])
+        if kind == KEYFRAME:
+            self.frame[:] = data
+        else:
+            apply_delta(self.frame, data)
+        return True
+
+    def send_edit(self, edit: dict):
+        send_message(self.connection, json.dumps(edit).encode())
+
+    def add_tile(self, tile_name: str, x: int, y: int):
+        self.send_edit({"type": "add", "tile": tile_name, "x": x, "y": y})
+
+    def delete_tile(self, x: int, y: int):
+        self.send_edit({"type": "delete", "x": x, "y": y})
+
+    def set_paused(self, paused: bool):
+        self.send_edit({"type": "pause" if paused else "resume"})
+
+    def close(self):
+        self.connection.close()
+
+
+def serve(address: str, world_size: Tuple[int, int]):
+    simulation = Simulation(World(*world_size))
+    server = start_server(simulation, address)
+    print(f"Serving a {world_size[0]}x{world_size[1]} world on {address}")
+    try:
+        simulation.run()
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+    server.server_close()
+
+
+def view(address: str):
+    import pygame
+    from pygame.locals import K_SPACE, KEYDOWN, MOUSEWHEEL, QUIT, RESIZABLE
+
+    client = SimulationClient(address)
+    # frames are received in the background, the window always shows the latest one
+    def receive_frames():
+        while client.receive_frame():
+            pass
+
+    receiver = threading.Thread(target=receive_frames, daemon=True)
+    receiver.start()
+    pygame.init()
+    window = pygame.display.set_mode((1280, 720), RESIZABLE)
+    pygame.display.set_caption(f"SandBox viewer ({address})")
+    clock = pygame.time.Clock()
+    selected_tile: int = 0
+    paused: bool = False
+    while receiver.is_alive():
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                client.close()
+                pygame.quit()
+                return
+            if event.type == MOUSEWHEEL:
+                selected_tile = (selected_tile + (1 if event.y > 0 else -1)) % len(client.tiles)
+                pygame.display.set_caption(f"SandBox viewer ({address}): {client.tiles[selected_tile]}")
+            if event.type == KEYDOWN and event.key == K_SPACE:
+                paused = not paused
+                client.set_paused(paused)
+        window_size = window.get_size()
+        mouse_pos = pygame.mouse.get_pos()
+        x = min(max(mouse_pos[0] * client.width // window_size[0], 0), client.width - 1)
+        y = min(max(mouse_pos[1] * client.height // window_size[1], 0), client.height - 1)
+        if pygame.mouse.get_pressed()[0]:
+            client.add_tile(client.tiles[selected_tile], x, y)
+        elif pygame.mouse.get_pressed()[2]:
+            client.delete_tile(x, y)
+        world_surface = pygame.image.frombuffer(bytes(client.frame), (client.width, client.height), "P")
+        world_surface.set_palette(client.palette)
+        window.blit(pygame.transform.scale(world_surface, window_size), (0, 0))
+        pygame.display.flip()
+        clock.tick(60)
+    pygame.quit()
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("serve", "view"):
+        print(__doc__)
+        sys.exit(1)
+    address = sys.argv[2] if len(sys.argv) >= 3 else DEFAULT_ADDRESS
+    if sys.argv[1] == "serve":
+        world_size = (int(sys.argv[3]), int(sys.argv[4])) if len(sys.argv) >= 5 else WORLD_SIZE
+        serve(address, world_size)
+    else:
+        view(address)
+
+
+if __name__ == "__main__":
+    main()